@@ -18,9 +18,19 @@ import wx
 import os
 import logging
 import shutil
+import json
 import sqlinstances
+import summary_reports
 import pyodbc
 import inspect
+import lifeline_results
+import geometry_cache
+import result_watch
+import writeback
+import template_indexes
+import output_profiles
+import ensemble_statistics
+import extraction_sql
 from arcpy import mapping
 from arcpy import management
 from arcpy import da
@@ -82,6 +92,9 @@ Select your HAZUS Server and the study region from the list below to get started
         self.scenario_dir = ""
         self.scenario_data_dir = ""
         self.study_region_data = ""
+        self.summary = None
+        self.geometry_cache = None
+        self.writeback = None
         self.output_directory_dialog_button.Bind(wx.EVT_BUTTON, self.select_output_directory)
 
         # the server and database info box
@@ -118,8 +131,27 @@ Select your HAZUS Server and the study region from the list below to get started
         self.db_list.SetFont(normal_font)
         database_box.Add(self.db_list)
         self.hazus_db = ""
+        # Scenario databases and statistic used to create ensemble maps
+        self.ensemble_dbs = []
+        self.ensemble_statistic = ensemble_statistics.DEFAULT_STATISTIC
         self.db_list.Bind(wx.EVT_COMBOBOX, self.select_hazus_db)
 
+        # Create a drop down menu to select the output profile used to export the maps
+        profile_box = wx.BoxSizer(wx.HORIZONTAL)
+        server_and_db_sizer.Add(profile_box)
+        self.output_profile_label = wx.StaticText(server_and_db_sizer.GetStaticBox(), -1, "Select an output profile")
+        self.output_profile_label.SetFont(normal_font)
+        profile_box.Add(self.output_profile_label)
+        profile_box.Add(wx.Size(20, 10))
+        self.output_profile_list = wx.ComboBox(self.serverinfo_staticbox, -1, output_profiles.DEFAULT_PROFILE,
+                                               choices=sorted(output_profiles.OUTPUT_PROFILES),
+                                               size=wx.Size(300, -1), style=wx.CB_READONLY)
+        self.output_profile_list.SetFont(normal_font)
+        profile_box.Add(self.output_profile_list)
+        self.output_profiles = [output_profiles.DEFAULT_PROFILE]
+        self.export_stats = {}
+        self.output_profile_list.Bind(wx.EVT_COMBOBOX, self.select_output_profile)
+
         # the create maps box
         self.create_maps_staticbox = wx.StaticBox(self.main_panel, -1, "Choose your maps", size=wx.Size(-1, -1))
         self.create_maps_staticbox.SetFont(normal_font)
@@ -195,6 +227,15 @@ Select your HAZUS Server and the study region from the list below to get started
         primary_button_sizer.Add(self.reset_button, 0, wx.ALL, 20)
         # self.Bind(wx.EVT_BUTTON, self.OnReset, self.resetButton)
 
+        # Create a button that keeps watching the study region for new results
+        self.watch_button = wx.Button(self.main_panel, label="Watch", size=wx.Size(150, 100))
+        self.watch_button.SetFont(label_font)
+        primary_button_sizer.Add(self.watch_button, 0, wx.ALL, 20)
+        self.Bind(wx.EVT_BUTTON, self.toggle_watch, self.watch_button)
+        self.watcher = None
+        self.watch_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.poll_results, self.watch_timer)
+
         box.Add(welcome_sizer, 0.5, wx.EXPAND)
         box.Add(output_directory_sizer, 0.5, wx.EXPAND)
         box.Add(server_and_db_sizer, 0.5, wx.EXPAND)
@@ -258,6 +299,12 @@ Select your HAZUS Server and the study region from the list below to get started
         self.selected_map_list.Enable()
         self.sb.SetStatusText("Please choose the maps you want to create")
 
+    def select_output_profile(self, event):
+        """This function allows the user to choose the output profile, which sets
+        the resolution and compression used when the maps are exported."""
+        self.output_profiles = [self.output_profile_list.GetValue()]
+        self.logger.info("Output profile: " + self.output_profiles[0])
+
     # 5. Choose map or maps from list of templates and add to list of maps to create
     def select_maps(self, event):
         """This function allows the user to select some or all of the available maps and add them
@@ -308,42 +355,97 @@ Select your HAZUS Server and the study region from the list below to get started
         for new_dir in output_dirs:
             os.mkdir(new_dir)
         self.sb.SetStatusText("Created output dirs in: " + self.scenario_dir)
+        self.prepare_template_indexes()
+        self.summary = summary_reports.SummaryReport()
+        self.geometry_cache = geometry_cache.GeneralizedCache(self.study_region_data, self.logger)
+        self.writeback = writeback.WriteBackScheduler(self.logger)
         self.connect_to_db()
 
+    def prepare_template_indexes(self):
+        """This function makes sure the join keys and the fields used to remove
+        features outside of the study region are indexed in the template
+        geodatabase, and records which indexes were present or created."""
+        results = template_indexes.ensure_indexes(self.study_region_data, self.logger)
+        report = template_indexes.write_index_report(results, self.scenario_dir + "\\Summary_Reports")
+        self.logger.info("Wrote template index report: " + report)
+        self.sb.SetStatusText("Checked attribute indexes in " + self.study_region_data)
+
     # 6.b Extract data from SQL Server
     # Use pyodbc to connect to SQL Server
     def connect_to_db(self):
         """This function establishes a connection to the selected HAZUS database
         to extract data for the selected maps."""
+        if self.ensemble_dbs:
+            # Run every query against all of the scenario databases and map the
+            # ensemble statistic instead of a single scenario.  ensemble needs
+            # numpy, so it is only imported for ensemble maps.
+            import ensemble
+            conns = [self.open_db_connection(db) for db in self.ensemble_dbs]
+            cursor = ensemble.EnsembleCursor([conn.cursor() for conn in conns], self.ensemble_statistic,
+                                             self.logger)
+            self.logger.info("Creating %s ensemble maps from %d scenarios" %
+                             (self.ensemble_statistic, len(self.ensemble_dbs)))
+        else:
+            conns = [self.open_db_connection()]
+            cursor = conns[0].cursor()
+        self.determine_map_extent(cursor)
+        self.create_selected_maps(cursor, self.selected_map_methods())
+        cursor.close()
+        for conn in conns:
+            conn.close()
+        self.sb.SetStatusText("Closed connection to the HAZUS database")
+        self.write_summary_reports()
+
+    def open_db_connection(self, database=None):
+        """This function returns a pyodbc connection to a HAZUS database, by
+        default the selected one."""
+        if database is None:
+            database = self.hazus_db
         connection_str = """
         DRIVER={SQL Server};
         SERVER=%s;
         DATABASE=%s;
         UID=hazuspuser;
-        PWD=gohazusplus_01""" % (self.hazus_server, self.hazus_db)
+        PWD=gohazusplus_01""" % (self.hazus_server, database)
 
         conn = pyodbc.connect(connection_str)
-        self.sb.SetStatusText("Established connection to: " + self.hazus_db)
-        self.logger.info("Established connection to: " + self.hazus_db)
-        cursor = conn.cursor()
+        self.sb.SetStatusText("Established connection to: " + database)
+        self.logger.info("Established connection to: " + database)
+        return conn
+
+    def selected_map_methods(self):
+        """This function converts the names of the selected maps into the names
+        of the functions that create them, e.g. Shelter Needs -> shelter_needs."""
         maps_to_create = []
         for selected_map in self.selected_maps:
             self.logger.info("Selected map list includes: " + selected_map)
             lower_case = selected_map.lower()
             no_spaces = lower_case.replace(" ", "_")
             maps_to_create.append(str(no_spaces))
+        return maps_to_create
 
-        self.determine_map_extent(cursor)
+    def create_selected_maps(self, cursor, maps_to_create):
+        """This function extracts the data for each map, writes it to the template
+        geodatabase and exports the map."""
         # Call a function to extract the data needed for each map
         # For example, if building inspection needs is one of the selected maps,
         # the getattr() statement below generates the following:
         # getattr(self, building_inspection_needs)(), which is equivalent to:
         # self.building_inspection_needs()
         for m in maps_to_create:
+            self.summary.begin_map(m)
             getattr(self, m)(cursor)
-        cursor.close()
-        conn.close()
-        self.sb.SetStatusText("Closed connection to the HAZUS database")
+
+    def write_summary_reports(self):
+        """This function writes the regional totals, top tracts and facility
+        damage counts collected while the maps were populated to the
+        Summary_Reports folder."""
+        summary_dir = self.scenario_dir + "\\Summary_Reports"
+        for report in self.summary.write(summary_dir):
+            self.logger.info("Wrote summary report: " + report)
+        report = output_profiles.write_export_stats(self.export_stats, summary_dir)
+        self.logger.info("Wrote summary report: " + report)
+        self.sb.SetStatusText("Wrote summary reports to " + summary_dir)
 
     def determine_map_extent(self, cursor):
         """This function accepts a cursor from pyodbc to call the SQL Server
@@ -381,6 +483,10 @@ Select your HAZUS Server and the study region from the list below to get started
         self.map_extent["YMin"] = tract_extent.YMin
         self.map_extent["YMax"] = tract_extent.YMax
 
+        # Save the extent so the tile export can cover the same area as the maps
+        with open(self.scenario_dir + "\\Summary_Reports\\MapExtent.json", "w") as f:
+            json.dump(self.map_extent, f, indent=2, sort_keys=True)
+
         self.sb.SetStatusText("Determined map extent")
 
     # 6.c Create table queries to get only the data we need
@@ -392,34 +498,25 @@ Select your HAZUS Server and the study region from the list below to get started
         self.logger.info("You want to make a building inspection needs map!")
 
         # Get the data from SQL Server
-        building_inspection_sql = """
-        SELECT Tract, Sum(PDsSlightBC) as PDsSlightBC, Sum(PDsModerateBC) as PDsModerateBC,
-        Sum(PDsExtensiveBC) as PDsExtensiveBC, Sum(PDsCompleteBC) as PDsCompleteBC
-        FROM eqTractDmg WHERE DmgMechType='STR'
-        GROUP BY Tract
-        """
-        cursor.execute(building_inspection_sql)
+        cursor.execute(extraction_sql.build_sql("building_inspection_needs"))
         inspection_tracts = cursor.fetchall()
 
         # Update the corresponding fields in the StudyRegionData.mdb\eqTract table
         fc = self.study_region_data + "\\eqTract"
-        for ins_tract in inspection_tracts:
-            tract = ins_tract.Tract
+        fields = ['PDsSlightBC', 'PDsModerateBC', 'PDsExtensiveBC', 'PDsCompleteBC', 'SL_MO_TOT']
+
+        def inspection_values(ins_tract):
             slight = ins_tract.PDsSlightBC
             moderate = ins_tract.PDsModerateBC
             extensive = ins_tract.PDsExtensiveBC
             complete = ins_tract.PDsCompleteBC
+            slight_moderate = ins_tract.SL_MO_TOT
+            self.summary.add_row("eqTract", ins_tract.Tract, {"PDsSlightBC": slight, "PDsModerateBC": moderate,
+                                                              "PDsExtensiveBC": extensive,
+                                                              "PDsCompleteBC": complete})
+            return [slight, moderate, extensive, complete, slight_moderate]
 
-            query = '[Tract] = ' + '\'' + tract + '\''
-            fields = ['PDsSlightBC', 'PDsModerateBC', 'PDsExtensiveBC', 'PDsCompleteBC', 'SL_MO_TOT']
-            with da.UpdateCursor(fc, fields, query) as urows:
-                for urow in urows:
-                    urow[0] = slight
-                    urow[1] = moderate
-                    urow[2] = extensive
-                    urow[3] = complete
-                    urow[4] = slight + moderate
-                    urows.updateRow(urow)
+        writeback.ordered_update(fc, 'Tract', fields, inspection_tracts, inspection_values)
 
         self.update_fc(fc, 'PDsSlightBC')
 
@@ -434,26 +531,19 @@ Select your HAZUS Server and the study region from the list below to get started
         self.logger.info("You want to make a direct economic loss map!")
 
         # Get the data from SQL Server
-        economic_loss_sql = """
-        SELECT Tract, Sum(TotalLoss) as TotalLoss
-        FROM eqTractEconLoss
-        GROUP BY Tract
-        """
-        cursor.execute(economic_loss_sql)
+        cursor.execute(extraction_sql.build_sql("direct_economic_loss"))
         del_tracts = cursor.fetchall()
 
         # Update the corresponding fields in the StudyRegionData.mdb\eqTract table
         fc = self.study_region_data + "\\eqTract"
-        for del_tract in del_tracts:
-            tract = del_tract.Tract
+        fields = ['TotalEconLoss']
+
+        def economic_loss_values(del_tract):
             total_econ_loss = del_tract.TotalLoss
+            self.summary.add_row("eqTract", del_tract.Tract, {"TotalEconLoss": total_econ_loss})
+            return [total_econ_loss]
 
-            query = '[Tract] = ' + '\'' + tract + '\''
-            fields = ['TotalEconLoss']
-            with da.UpdateCursor(fc, fields, query) as urows:
-                for urow in urows:
-                    urow[0] = total_econ_loss
-                    urows.updateRow(urow)
+        writeback.ordered_update(fc, 'Tract', fields, del_tracts, economic_loss_values)
 
         self.update_fc(fc, 'TotalEconLoss')
 
@@ -468,29 +558,22 @@ Select your HAZUS Server and the study region from the list below to get started
         self.logger.info("You want to make an estimated debris map!")
 
         # Get the data from SQL Server
-        debris_sql = """
-        SELECT Tract, DebrisS, DebrisC, DebrisTotal
-        FROM eqTract
-        """
-        cursor.execute(debris_sql)
+        cursor.execute(extraction_sql.build_sql("estimated_debris"))
         debris_tracts = cursor.fetchall()
 
         # Update the corresponding fields in the StudyRegionData.mdb\eqTract table
         fc = self.study_region_data + "\\eqTract"
-        for debris_tract in debris_tracts:
-            tract = debris_tract.Tract
+        fields = ['DebrisS', 'DebrisC', 'DebrisTotal']
+
+        def debris_values(debris_tract):
             debriss = debris_tract.DebrisS
             debrisc = debris_tract.DebrisC
             debris_total = debris_tract.DebrisTotal
+            self.summary.add_row("eqTract", debris_tract.Tract, {"DebrisS": debriss, "DebrisC": debrisc,
+                                                                 "DebrisTotal": debris_total})
+            return [debriss, debrisc, debris_total]
 
-            query = '[Tract] = ' + '\'' + tract + '\''
-            fields = ['DebrisS', 'DebrisC', 'DebrisTotal']
-            with da.UpdateCursor(fc, fields, query) as urows:
-                for urow in urows:
-                    urow[0] = debriss
-                    urow[1] = debrisc
-                    urow[2] = debris_total
-                    urows.updateRow(urow)
+        writeback.ordered_update(fc, 'Tract', fields, debris_tracts, debris_values)
 
         self.update_fc(fc, 'DebrisTotal')
 
@@ -505,58 +588,21 @@ Select your HAZUS Server and the study region from the list below to get started
         self.logger.info("You want to make a highway Infrastructure damage map!")
 
         # Get the data from SQL Server
-        highways_sql = """
-        SELECT HighwaySegID, PDsExceedModerate, FunctDay1, EconLoss
-        FROM eqHighwaySegment
-        """
-        cursor.execute(highways_sql)
-        highways = cursor.fetchall()
+        cursor.execute(extraction_sql.build_sql("highway_segments"))
+        highways = lifeline_results.LifelineResults.from_cursor(cursor, "eqHighwaySegment")
 
         # Update the corresponding fields in the StudyRegionData.mdb\eqHighwaySegment table
         highway_fc = self.study_region_data + "\\eqHighwaySegment"
-        for highway in highways:
-            highway_id = highway.HighwaySegID
-            highway_moderate = highway.PDsExceedModerate
-            highway_functday1 = highway.FunctDay1
-            highway_econ_loss = highway.EconLoss
-
-            query = '[HighwaySegID] = ' + '\'' + highway_id + '\''
-            fields = ['PDsExceedModerate', 'FunctDay1', 'EconLoss']
-            with da.UpdateCursor(highway_fc, fields, query) as urows:
-                for urow in urows:
-                    urow[0] = highway_moderate
-                    urow[1] = highway_functday1
-                    urow[2] = highway_econ_loss
-                    urows.updateRow(urow)
-
-        self.update_fc(highway_fc, 'PDsExceedModerate')
+        self.add_lifeline_writeback(highway_fc, 'HighwaySegID', highways)
 
         # Get the data from SQL Server
-        bridges_sql = """
-        SELECT HighwayBridgeID, PDsExceedModerate, FunctDay1, EconLoss
-        FROM eqHighwayBridge
-        """
-        cursor.execute(bridges_sql)
-        bridges = cursor.fetchall()
+        cursor.execute(extraction_sql.build_sql("highway_bridges"))
+        bridges = lifeline_results.LifelineResults.from_cursor(cursor, "eqHighwayBridge")
 
         # Update the corresponding fields in the StudyRegionData.mdb\eqHighwayBridge table
         bridge_fc = self.study_region_data + "\\eqHighwayBridge"
-        for bridge in bridges:
-            bridge_id = bridge.HighwayBridgeID
-            bridge_moderate = bridge.PDsExceedModerate
-            bridge_functday1 = bridge.FunctDay1
-            bridge_econ_loss = bridge.EconLoss
-
-            query = '[HighwayBridgeId] = ' + '\'' + bridge_id + '\''
-            fields = ['PDsExceedModerate', 'FunctDay1', 'EconLoss']
-            with da.UpdateCursor(bridge_fc, fields, query) as urows:
-                for urow in urows:
-                    urow[0] = bridge_moderate
-                    urow[1] = bridge_functday1
-                    urow[2] = bridge_econ_loss
-                    urows.updateRow(urow)
-
-        self.update_fc(bridge_fc, 'PDsExceedModerate')
+        self.add_lifeline_writeback(bridge_fc, 'HighwayBridgeId', bridges)
+        self.writeback.run()
 
         # Update and export the map
         mxd = self.scenario_data_dir + "\\Maps\\HighwayInfrastructureDamage.mxd"
@@ -570,68 +616,44 @@ Select your HAZUS Server and the study region from the list below to get started
         self.logger.info("You want to make an impaired hospitals map!")
 
         # Get the data from SQL Server
-        hospital_sql = """
-        SELECT CareFltyID, PDsExceedModerate, FunctDay1, EconLoss
-        FROM eqCareFlty
-        """
-        injury_sql = """
-        SELECT Tract, Sum(Level1Injury) as Level1Injury, Sum(Level2Injury) as Level2Injury,
-        Sum(Level3Injury) as Level3Injury, Sum(Level4Injury) as Level4Injury
-        FROM eqTractCasOccup
-        WHERE CasTime = 'D' AND InOutTot = 'TOT'
-        GROUP BY Tract
-        """
-        cursor.execute(hospital_sql)
-        hospitals = cursor.fetchall()
+        cursor.execute(extraction_sql.build_sql("hospitals"))
+        hospitals = lifeline_results.LifelineResults.from_cursor(cursor, "eqCareFlty")
 
         # Update the corresponding fields in the StudyRegionData.mdb\eqCareFlty table
         hospital_fc = self.study_region_data + "\\eqCareFlty"
-        for hospital in hospitals:
-            hospital_id = hospital.CareFltyID
-            hospital_moderate = hospital.PDsExceedModerate
-            hospital_functday1 = hospital.FunctDay1
-            hospital_econ_loss = hospital.EconLoss
-
-            query = '[CareFltyId] = ' + '\'' + hospital_id + '\''
-            fields = ['PDsExceedModerate', 'FunctDay1', 'EconLoss']
-            with da.UpdateCursor(hospital_fc, fields, query) as urows:
-                for urow in urows:
-                    urow[0] = hospital_moderate
-                    urow[1] = hospital_functday1
-                    urow[2] = hospital_econ_loss
-                    urows.updateRow(urow)
-
-        self.update_fc(hospital_fc, 'PDsExceedModerate')
+        self.add_lifeline_writeback(hospital_fc, 'CareFltyId', hospitals)
 
         # Update the corresponding fields in the StudyRegionData.mdb\eqTract table
-        cursor.execute(injury_sql)
+        cursor.execute(extraction_sql.build_sql("injuries"))
         injury_tracts = cursor.fetchall()
         fc = self.study_region_data + "\\eqTract"
-        for injury_tract in injury_tracts:
-            tract = injury_tract.Tract
-            level1 = injury_tract.Level1Injury
-            level2 = injury_tract.Level2Injury
-            level3 = injury_tract.Level3Injury
-            level4 = injury_tract.Level4Injury
-
-            query = '[Tract] = ' + '\'' + tract + '\''
-            fields = ['Level1Injury', 'Level2Injury', 'Level3Injury', 'Level4Injury', 'SUM_2_3']
-            with da.UpdateCursor(fc, fields, query) as urows:
-                for urow in urows:
-                    urow[0] = level1
-                    urow[1] = level2
-                    urow[2] = level3
-                    urow[3] = level4
-                    urow[4] = level2 + level3
-                    urows.updateRow(urow)
-
-        self.update_fc(fc, 'Level1Injury')
+        self.writeback.add(fc, str(len(injury_tracts)) + " injury rows", self.write_injuries, fc, injury_tracts)
+        self.writeback.add(fc, "Level1Injury prune", self.update_fc, fc, 'Level1Injury')
+        self.writeback.run()
 
         # Update and export the map
         mxd = self.scenario_data_dir + "\\Maps\\ImpairedHospitals.mxd"
         map_name = "ImpairedHospitals"
         self.update_and_export_map(mxd, map_name)
 
+    def write_injuries(self, fc, injury_tracts):
+        """This function writes the injury counts from the eqTractCasOccup query
+        to the matching tracts in the eqTract feature class."""
+        fields = ['Level1Injury', 'Level2Injury', 'Level3Injury', 'Level4Injury', 'SUM_2_3']
+
+        def injury_values(injury_tract):
+            level1 = injury_tract.Level1Injury
+            level2 = injury_tract.Level2Injury
+            level3 = injury_tract.Level3Injury
+            level4 = injury_tract.Level4Injury
+            life_threatening = injury_tract.SUM_2_3
+            self.summary.add_row("eqTract", injury_tract.Tract, {"Level1Injury": level1, "Level2Injury": level2,
+                                                                 "Level3Injury": level3, "Level4Injury": level4,
+                                                                 "SUM_2_3": life_threatening})
+            return [level1, level2, level3, level4, life_threatening]
+
+        writeback.ordered_update(fc, 'Tract', fields, injury_tracts, injury_values)
+
     def search_and_rescue_needs(self, cursor):
         """This function creates a search and rescue needs map by querying the
         eqTractDmg table in the SQL Server database.  Search and rescue needs are
@@ -640,26 +662,19 @@ Select your HAZUS Server and the study region from the list below to get started
         self.logger.info("You want to make a search and rescue needs map!")
 
         # Get the data from SQL Server
-        sar_sql = """
-        SELECT Tract, Sum(PDsCompleteBC) as PDsCompleteBC
-        FROM eqTractDmg WHERE DmgMechType='STR'
-        GROUP BY Tract
-        """
-        cursor.execute(sar_sql)
+        cursor.execute(extraction_sql.build_sql("search_and_rescue_needs"))
         sar_tracts = cursor.fetchall()
 
         # Update the corresponding fields in the StudyRegionData.mdb\eqTract table
         fc = self.study_region_data + "\\eqTract"
-        for sar_tract in sar_tracts:
-            tract = sar_tract.Tract
+        fields = ['PDsCompleteBC']
+
+        def sar_values(sar_tract):
             complete = sar_tract.PDsCompleteBC
+            self.summary.add_row("eqTract", sar_tract.Tract, {"PDsCompleteBC": complete})
+            return [complete]
 
-            query = '[Tract] = ' + '\'' + tract + '\''
-            fields = ['PDsCompleteBC']
-            with da.UpdateCursor(fc, fields, query) as urows:
-                for urow in urows:
-                    urow[0] = complete
-                    urows.updateRow(urow)
+        writeback.ordered_update(fc, 'Tract', fields, sar_tracts, sar_values)
 
         self.update_fc(fc, 'PDsCompleteBC')
 
@@ -674,31 +689,25 @@ Select your HAZUS Server and the study region from the list below to get started
         self.logger.info("You want to make a shelter needs map!")
 
         # Get the data from SQL Server
-        shelter_sql = """
-        SELECT Tract, ShortTermShelter, DisplacedHouseholds, ExposedPeople, ExposedValue
-        FROM eqTract
-        """
-        cursor.execute(shelter_sql)
+        cursor.execute(extraction_sql.build_sql("shelter_needs"))
         shelter_tracts = cursor.fetchall()
 
         # Update the corresponding fields in the StudyRegionData.mdb\eqTract table
         fc = self.study_region_data + "\\eqTract"
-        for shelter_tract in shelter_tracts:
-            tract = shelter_tract.Tract
+        fields = ['DisplacedHouseholds', 'ShortTermShelter', 'ExposedPeople', 'ExposedValue']
+
+        def shelter_values(shelter_tract):
             displaced = shelter_tract.DisplacedHouseholds
             shelter = shelter_tract.ShortTermShelter
             exposed_people = shelter_tract.ExposedPeople
             exposed_value = shelter_tract.ExposedValue
+            self.summary.add_row("eqTract", shelter_tract.Tract, {"DisplacedHouseholds": displaced,
+                                                                  "ShortTermShelter": shelter,
+                                                                  "ExposedPeople": exposed_people,
+                                                                  "ExposedValue": exposed_value})
+            return [displaced, shelter, exposed_people, exposed_value]
 
-            query = '[Tract] = ' + '\'' + tract + '\''
-            fields = ['DisplacedHouseholds', 'ShortTermShelter', 'ExposedPeople', 'ExposedValue']
-            with da.UpdateCursor(fc, fields, query) as urows:
-                for urow in urows:
-                    urow[0] = displaced
-                    urow[1] = shelter
-                    urow[2] = exposed_people
-                    urow[3] = exposed_value
-                    urows.updateRow(urow)
+        writeback.ordered_update(fc, 'Tract', fields, shelter_tracts, shelter_values)
 
         self.update_fc(fc, 'DisplacedHouseholds')
 
@@ -714,85 +723,29 @@ Select your HAZUS Server and the study region from the list below to get started
         self.logger.info("You want to make a utility damage map!")
 
         # Get the datat from SQL Server
-        electric_flty_sql = """
-        SELECT ElectricPowerFltyID, PDsExceedModerate, FunctDay1, EconLoss
-        FROM eqElectricPowerFlty
-        """
-        cursor.execute(electric_flty_sql)
-        electric_facilities = cursor.fetchall()
+        cursor.execute(extraction_sql.build_sql("electric_power_facilities"))
+        electric_facilities = lifeline_results.LifelineResults.from_cursor(cursor, "eqElectricPowerFlty")
 
         # Update the corresponding fields in the StudyRegionData.mdb\eqElectricPowerFlty table
         electric_fc = self.study_region_data + "\\eqElectricPowerFlty"
-        for electric_facility in electric_facilities:
-            electric_flty_id = electric_facility.ElectricPowerFltyID
-            electric_flty_moderate = electric_facility.PDsExceedModerate
-            electric_flty_funct_day1 = electric_facility.FunctDay1
-            electric_flty_econ_loss = electric_facility.EconLoss
-
-            query = '[ElectricPowerFltyID] = ' + '\'' + electric_flty_id + '\''
-            fields = ['PDsExceedModerate', 'FunctDay1', 'EconLoss']
-            with da.UpdateCursor(electric_fc, fields, query) as urows:
-                for urow in urows:
-                    urow[0] = electric_flty_moderate
-                    urow[1] = electric_flty_moderate
-                    urow[2] = electric_flty_econ_loss
-                    urows.updateRow(urow)
-
-        self.update_fc(electric_fc, 'PDsExceedModerate')
+        self.add_lifeline_writeback(electric_fc, 'ElectricPowerFltyID', electric_facilities)
 
         # Get the datat from SQL Server
-        natural_gas_flty_sql = """
-        SELECT NaturalGasFltyID, PDsExceedModerate, FunctDay1, EconLoss
-        FROM eqNaturalGasFlty
-        """
-        cursor.execute(natural_gas_flty_sql)
-        natural_gas_facilities = cursor.fetchall()
+        cursor.execute(extraction_sql.build_sql("natural_gas_facilities"))
+        natural_gas_facilities = lifeline_results.LifelineResults.from_cursor(cursor, "eqNaturalGasFlty")
 
         # Update the corresponding fields in the StudyRegionData.mdb\eqNaturalGasFlty table
         ng_fc = self.study_region_data + "\\eqNaturalGasFlty"
-        for natural_gas_facility in natural_gas_facilities:
-            natural_gas_flty_id = natural_gas_facility.NaturalGasFltyID
-            natural_gas_flty_moderate = natural_gas_facility.PDsExceedModerate
-            natural_gas_flty_funct_day1 = natural_gas_facility.FunctDay1
-            natural_gas_flty_econ_loss = natural_gas_facility.EconLoss
-
-            query = '[NaturalGasFltyID] = ' + '\'' + natural_gas_flty_id + '\''
-            fields = ['PDsExceedModerate', 'FunctDay1', 'EconLoss']
-            with da.UpdateCursor(ng_fc, fields, query) as urows:
-                for urow in urows:
-                    urow[0] = natural_gas_flty_moderate
-                    urow[1] = natural_gas_flty_moderate
-                    urow[2] = natural_gas_flty_econ_loss
-                    urows.updateRow(urow)
-
-        self.update_fc(ng_fc, 'PDsExceedModerate')
+        self.add_lifeline_writeback(ng_fc, 'NaturalGasFltyID', natural_gas_facilities)
 
         # Get the datat from SQL Server
-        oil_flty_sql = """
-        SELECT OilFltyID, PDsExceedModerate, FunctDay1, EconLoss
-        FROM eqOilFlty
-        """
-        cursor.execute(oil_flty_sql)
-        oil_facilities = cursor.fetchall()
+        cursor.execute(extraction_sql.build_sql("oil_facilities"))
+        oil_facilities = lifeline_results.LifelineResults.from_cursor(cursor, "eqOilFlty")
 
         # Update the corresponding fields in the StudyRegionData.mdb\eqOilFlty table
         oil_fc = self.study_region_data + "\\eqOilFlty"
-        for oil_facility in oil_facilities:
-            oil_flty_id = oil_facility.OilFltyID
-            oil_flty_moderate = oil_facility.PDsExceedModerate
-            oil_flty_funct_day1 = oil_facility.FunctDay1
-            oil_flty_econ_loss = oil_facility.EconLoss
-
-            query = '[OilFltyID] = ' + '\'' + oil_flty_id + '\''
-            fields = ['PDsExceedModerate', 'FunctDay1', 'EconLoss']
-            with da.UpdateCursor(oil_fc, fields, query) as urows:
-                for urow in urows:
-                    urow[0] = oil_flty_moderate
-                    urow[1] = oil_flty_moderate
-                    urow[2] = oil_flty_econ_loss
-                    urows.updateRow(urow)
-
-        self.update_fc(oil_fc, 'PDsExceedModerate')
+        self.add_lifeline_writeback(oil_fc, 'OilFltyID', oil_facilities)
+        self.writeback.run()
 
         # Update and export the map
         mxd = self.scenario_data_dir + "\\Maps\\UtilityDamage.mxd"
@@ -805,33 +758,26 @@ Select your HAZUS Server and the study region from the list below to get started
         self.logger.info("You want to make a water Infrastructure damage map!")
 
         # Get the data from SQL Server
-        water_sql = """
-        SELECT Tract, TotalPipe, TotalNumRepairs, TotalDysRepairs, EconLoss, Cost
-        FROM eqPotableWaterDL
-        """
-        cursor.execute(water_sql)
+        cursor.execute(extraction_sql.build_sql("water_infrastructure_damage"))
         water_tracts = cursor.fetchall()
 
         # Update the corresponding fields in the StudyRegionData.mdb\eqPotableWaterDL table
         fc = self.study_region_data + "\\eqPotableWaterDL"
-        for water_tract in water_tracts:
-            tract = water_tract.Tract
+        fields = ['TotalPipe', 'TotalNumRepairs', 'TotalDysRepairs', 'EconLoss', 'Cost']
+
+        def water_values(water_tract):
             total_pipe = water_tract.TotalPipe
             total_repairs = water_tract.TotalNumRepairs
             total_days = water_tract.TotalDysRepairs
             econ_loss = water_tract.EconLoss
             cost = water_tract.Cost
+            self.summary.add_row("eqPotableWaterDL", water_tract.Tract, {"TotalPipe": total_pipe,
+                                                                         "TotalNumRepairs": total_repairs,
+                                                                         "TotalDysRepairs": total_days,
+                                                                         "EconLoss": econ_loss, "Cost": cost})
+            return [total_pipe, total_repairs, total_days, econ_loss, cost]
 
-            query = '[Tract] = ' + '\'' + tract + '\''
-            fields = ['TotalPipe', 'TotalNumRepairs', 'TotalDysRepairs', 'EconLoss', 'Cost']
-            with da.UpdateCursor(fc, fields, query) as urows:
-                for urow in urows:
-                    urow[0] = total_pipe
-                    urow[1] = total_repairs
-                    urow[2] = total_days
-                    urow[3] = econ_loss
-                    urow[4] = cost
-                    urows.updateRow(urow)
+        writeback.ordered_update(fc, 'Tract', fields, water_tracts, water_values)
 
         self.update_fc(fc, 'EconLoss')
 
@@ -840,6 +786,29 @@ Select your HAZUS Server and the study region from the list below to get started
         map_name = "WaterInfrastructureDamage"
         self.update_and_export_map(mxd, map_name)
 
+    def add_lifeline_writeback(self, fc, id_field, results):
+        """This function schedules the write-back of a LifelineResults container
+        to a lifeline feature class, followed by removing the records that are
+        not part of the study region."""
+        self.writeback.add(fc, str(len(results)) + " " + results.table + " rows", self.write_lifeline_results,
+                           fc, id_field, results)
+        self.writeback.add(fc, "PDsExceedModerate prune", self.update_fc, fc, 'PDsExceedModerate')
+
+    def write_lifeline_results(self, fc, id_field, results):
+        """This function writes the PDsExceedModerate, FunctDay1 and EconLoss
+        values held in a LifelineResults container to the matching records in
+        a lifeline feature class.  The id_field parameter is the name of the
+        facility or segment ID field in the feature class."""
+        self.logger.info("Holding %d %s rows in %d bytes" % (len(results), results.table, results.memory_usage()))
+        fields = ['PDsExceedModerate', 'FunctDay1', 'EconLoss']
+
+        def lifeline_values(result):
+            flty_id, moderate, funct_day1, econ_loss = result
+            self.summary.add_facility(results.table, flty_id, moderate, econ_loss)
+            return [moderate, funct_day1, econ_loss]
+
+        writeback.ordered_update(fc, id_field, fields, results, lifeline_values)
+
     def update_fc(self, fc, field):
         """This function updates a feature class that removes all of the records
         from the geodatabase that are not part of the study region.  The fc
@@ -848,9 +817,14 @@ Select your HAZUS Server and the study region from the list below to get started
         database.  Records not part of the study region will have a field value
         of NULL."""
         query = '[' + field + '] IS NULL'
+        deleted_rows = 0
         with da.UpdateCursor(fc, '*', query) as urows:
             for urow in urows:
                 urows.deleteRow()
+                deleted_rows += 1
+
+        # Any generalized copies of this feature class are now out of date
+        self.geometry_cache.source_changed(os.path.basename(fc), deleted_rows)
 
 # 6.d Update the template mxds with a new extent
 # Map symbology should be set from the template lyr files
@@ -876,15 +850,77 @@ Select your HAZUS Server and the study region from the list below to get started
 
         self.sb.SetStatusText("Updated: " + mxd)
 
+        # Draw the tracts and highway segments from generalized copies that fit
+        # the map scale.  The mxd was saved above, so the copy on disk still
+        # points at the full resolution feature classes.
+        for lyr in mapping.ListLayers(current_map, "", df):
+            if lyr.isFeatureLayer and lyr.datasetName in geometry_cache.GENERALIZED_FCS:
+                dataset = self.geometry_cache.dataset_for_scale(lyr.datasetName, df.scale)
+                if dataset != lyr.datasetName:
+                    lyr.replaceDataSource(self.study_region_data,
+                                          geometry_cache.workspace_type(self.study_region_data), dataset)
+                    self.logger.info("Drawing " + lyr.name + " from " + dataset + " at 1:" + str(int(df.scale)))
+
 # 6.e Export maps as PDF and JPEG
         pdf_out_dir = self.scenario_dir + "\\PDF"
         jpeg_out_dir = self.scenario_dir + "\\JPEG"
 
-        mapping.ExportToPDF(current_map, pdf_out_dir + "\\" + map_name + ".pdf")
-        mapping.ExportToJPEG(current_map, jpeg_out_dir + "\\" + map_name + ".jpeg", resolution=200)
+        for profile in self.output_profiles:
+            stats = output_profiles.export_map(current_map, map_name, pdf_out_dir, jpeg_out_dir, profile)
+            for stat_map, stat_profile, stat_format, seconds, size in stats:
+                self.export_stats[(stat_map, stat_profile, stat_format)] = (seconds, size)
+                self.logger.info("Exported %s %s (%s) in %.1f seconds, %d bytes" %
+                                 (stat_map, stat_format, stat_profile, seconds, size))
         self.sb.SetStatusText("Exported: " + map_name)
 
-# 7. View log files if desired
+# 7. Watch the study region for new results
+    def toggle_watch(self, event):
+        """This function starts or stops watch mode.  In watch mode the result
+        tables used by the selected maps are polled for changes, and only the
+        maps whose tables changed are regenerated."""
+        if self.watch_timer.IsRunning():
+            self.watch_timer.Stop()
+            self.watch_button.SetLabel("Watch")
+            self.sb.SetStatusText("Stopped watching " + self.hazus_db)
+            self.logger.info("Stopped watching " + self.hazus_db)
+            return
+
+        if not self.selected_maps:
+            self.sb.SetStatusText("Please choose the maps to watch before starting watch mode")
+            return
+
+        # Take the baseline before the first run so that results written while
+        # the maps are being created are picked up by the next poll
+        self.watcher = result_watch.ResultWatcher(self.selected_map_methods())
+        conn = self.open_db_connection()
+        cursor = conn.cursor()
+        self.watcher.snapshot(cursor)
+        cursor.close()
+        conn.close()
+        if self.scenario_dir == "":
+            self.copy_template(event)
+
+        self.watch_timer.Start(result_watch.WATCH_INTERVAL_SECONDS * 1000)
+        self.watch_button.SetLabel("Stop Watching")
+        self.sb.SetStatusText("Watching " + self.hazus_db + " for new results")
+        self.logger.info("Watching " + self.hazus_db + " for new results")
+
+    def poll_results(self, event):
+        """This function is called by the watch timer.  It checks the result
+        tables for changes and regenerates the affected maps."""
+        conn = self.open_db_connection()
+        cursor = conn.cursor()
+        changed_maps = self.watcher.changed_maps(cursor)
+        if changed_maps:
+            self.logger.info("Results changed for: " + ", ".join(changed_maps))
+            self.create_selected_maps(cursor, changed_maps)
+        cursor.close()
+        conn.close()
+        if changed_maps:
+            self.write_summary_reports()
+            self.sb.SetStatusText("Regenerated " + str(len(changed_maps)) + " maps, watching for new results")
+
+# 8. View log files if desired
     def __initlogging(self):
         """Initialize a log file to view all of the settings and error information each time
         the script runs."""
@@ -902,11 +938,37 @@ Select your HAZUS Server and the study region from the list below to get started
         # add ch to logger
         self.logger.addHandler(ch)
 
+
+# 9. Run a job from the render queue without showing the window
+def run_job(job_file):
+    """This function creates the maps described by a render queue job file.  The
+    main window is created but never shown, and the selections are taken from
+    the job instead of the user."""
+    with open(job_file) as f:
+        job = json.load(f)
+    job_app = wx.App(False)
+    job_frame = MainFrame(None)
+    job_frame.output_directory = job["output_directory"]
+    job_frame.hazus_server = job["server"]
+    job_frame.hazus_db = job["database"]
+    job_frame.selected_maps = list(job["maps"])
+    if job.get("profile"):
+        job_frame.output_profiles = list(job["profile"])
+    if job.get("ensemble"):
+        job_frame.ensemble_dbs = list(job["ensemble"])
+        job_frame.ensemble_statistic = job.get("statistic") or ensemble_statistics.DEFAULT_STATISTIC
+    job_frame.logger.info("Running render queue job " + job["id"])
+    job_frame.copy_template(None)
+    job_frame.Destroy()
+
 try:
-    app = wx.App()
-    frame = MainFrame(None)
-    frame.Show()
-    app.MainLoop()
+    if len(sys.argv) == 3 and sys.argv[1] == "--job":
+        run_job(sys.argv[2])
+    else:
+        app = wx.App()
+        frame = MainFrame(None)
+        frame.Show()
+        app.MainLoop()
 
 except:
     # Error handling code from ArcGIS Resource Center
@@ -916,3 +978,4 @@ except:
         sys.exc_value) + "\n"
 
     print pymsg
+    sys.exit(1)
@@ -0,0 +1,162 @@
+# This module combines the results of many HAZUS earthquake scenarios that
+# cover the same study area into a single set of ensemble maps.  The same
+# extraction query is run against every scenario database and the results are
+# accumulated per key (tract, facility or segment) in float32 arrays.  An
+# EnsembleCursor then hands one row per key back to the map functions, with
+# each value replaced by the chosen statistic across the scenarios, so the
+# usual write-back and export path can be used unchanged.
+
+import collections
+import numpy
+
+from ensemble_statistics import STATISTICS
+
+
+def nan_percentile(matrix, q):
+    """Return the qth percentile of each row of matrix, ignoring NaN values.
+    Rows with no values get NaN."""
+    counts = (~numpy.isnan(matrix)).sum(axis=1)
+    ordered = numpy.sort(matrix, axis=1)  # NaN values sort to the end
+    position = numpy.maximum(counts - 1, 0) * (q / 100.0)
+    lower = numpy.floor(position).astype(int)
+    upper = numpy.ceil(position).astype(int)
+    rows = numpy.arange(matrix.shape[0])
+    fraction = position - lower
+    result = ordered[rows, lower] * (1 - fraction) + ordered[rows, upper] * fraction
+    result[counts == 0] = numpy.nan
+    return result
+
+
+class EnsembleAccumulator(object):
+    """Accumulates the numeric columns of one query across all scenarios.
+
+    Values are held in one float32 array per column with a row for each key
+    and a column for each scenario, so memory use is bounded by the number of
+    keys times the number of scenarios.  The arrays grow in blocks as new keys
+    are seen; missing and NULL values are stored as NaN and ignored by the
+    statistics."""
+
+    def __init__(self, columns, scenarios, block_size=4096):
+        self.key_column = columns[0]
+        self.value_columns = list(columns[1:])
+        self.scenarios = scenarios
+        self.block_size = block_size
+        self.keys = []
+        self.key_lookup = {}
+        self.values = [self.new_block(block_size) for column in self.value_columns]
+
+    def new_block(self, rows):
+        block = numpy.empty((rows, self.scenarios), dtype=numpy.float32)
+        block.fill(numpy.nan)
+        return block
+
+    def key_row(self, key):
+        row = self.key_lookup.get(key)
+        if row is None:
+            row = len(self.keys)
+            self.keys.append(key)
+            self.key_lookup[key] = row
+            if self.values and row >= self.values[0].shape[0]:
+                self.values = [numpy.vstack([v, self.new_block(self.block_size)]) for v in self.values]
+        return row
+
+    def add(self, scenario, rows):
+        """Add a batch of rows (key first, then the value columns) returned for
+        a scenario."""
+        positions = numpy.array([self.key_row(r[0]) for r in rows], dtype=int)
+        if not self.value_columns:
+            return
+        batch = numpy.array([[numpy.nan if v is None else v for v in r[1:]] for r in rows], dtype=numpy.float32)
+        for i, column in enumerate(self.values):
+            column[positions, scenario] = batch[:, i]
+
+    def statistic(self, name):
+        """Return an array per value column of the named statistic for each key."""
+        results = []
+        for column in self.values:
+            matrix = column[:len(self.keys)].astype(numpy.float64)
+            if name == "mean":
+                counts = (~numpy.isnan(matrix)).sum(axis=1)
+                totals = numpy.nansum(matrix, axis=1)
+                with numpy.errstate(invalid="ignore", divide="ignore"):
+                    results.append(totals / counts)
+            elif name in ("max", "min"):
+                results.append(nan_percentile(matrix, 100 if name == "max" else 0))
+            elif name.startswith("p"):
+                results.append(nan_percentile(matrix, float(name[1:])))
+            else:
+                raise ValueError("Unknown ensemble statistic: " + name)
+        return results
+
+    def memory_usage(self):
+        """Return the number of bytes held in the value arrays."""
+        return sum(v.nbytes for v in self.values)
+
+
+class EnsembleCursor(object):
+    """A stand-in for a pyodbc cursor that runs every query against all of the
+    scenario cursors and returns one row per key with the ensemble statistic.
+    The first column of each query must be the key; every other column must be
+    numeric.  Only the accumulator of the current query is held, and it is
+    released once the statistic has been computed, so memory use does not grow
+    with the number of queries.
+
+    Each column gets its own statistic, so only the mean of a sum of columns
+    equals the sum of their means.  Queries that need a sum (e.g., SUM_2_3)
+    return it as a column of its own; see extraction_sql.py."""
+
+    def __init__(self, cursors, statistic, logger, batch_size=5000):
+        if statistic not in STATISTICS:
+            raise ValueError("Unknown ensemble statistic: " + statistic)
+        self.cursors = cursors
+        self.statistic = statistic
+        self.logger = logger
+        self.batch_size = batch_size
+        self.rows = iter([])
+
+    def execute(self, sql):
+        accumulator = self.accumulate(sql)
+        columns = [accumulator.key_column] + accumulator.value_columns
+        row_type = collections.namedtuple("EnsembleRow", columns, rename=True)
+        # Keep one value per key and column; the keys x scenarios arrays are
+        # released with the accumulator
+        keys = accumulator.keys
+        statistics = accumulator.statistic(self.statistic)
+        del accumulator
+        self.rows = self.ensemble_rows(row_type, keys, statistics)
+        return self
+
+    def ensemble_rows(self, row_type, keys, statistics):
+        for i, k in enumerate(keys):
+            values = [None if numpy.isnan(s[i]) else float(s[i]) for s in statistics]
+            yield row_type(k, *values)
+
+    def accumulate(self, sql):
+        accumulator = None
+        for scenario, cursor in enumerate(self.cursors):
+            cursor.execute(sql)
+            if accumulator is None:
+                columns = [d[0] for d in cursor.description]
+                accumulator = EnsembleAccumulator(columns, len(self.cursors))
+            batch = cursor.fetchmany(self.batch_size)
+            while batch:
+                accumulator.add(scenario, batch)
+                batch = cursor.fetchmany(self.batch_size)
+        self.logger.info("Accumulated %d keys from %d scenarios in %d bytes" %
+                         (len(accumulator.keys), len(self.cursors), accumulator.memory_usage()))
+        return accumulator
+
+    def fetchmany(self, size=1):
+        batch = []
+        for row in self.rows:
+            batch.append(row)
+            if len(batch) == size:
+                break
+        return batch
+
+    def fetchall(self):
+        return list(self.rows)
+
+    def close(self):
+        for cursor in self.cursors:
+            cursor.close()
@@ -0,0 +1,8 @@
+# This module lists the statistics that ensemble maps can show.  It is kept
+# apart from ensemble.py, which needs numpy, so render queue jobs can be
+# checked and the map generator can start on machines without numpy.
+
+# Statistics that can be mapped.  pNN is the NNth percentile.
+STATISTICS = ["mean", "max", "min", "p10", "p50", "p90"]
+
+DEFAULT_STATISTIC = "mean"
@@ -0,0 +1,115 @@
+# This module generates the SQL used to extract HAZUS results for each map.
+# Every query joins the result table to the matching HAZUS inventory table on
+# the server, so only rows for the study region are returned, projects only
+# the columns the map writes, and orders the rows by the join key so they can
+# be written back to the template geodatabase in a single ordered pass.
+
+# Each spec names the result table, its key column, the inventory table (and
+# key) used to restrict rows to the study region, the columns to return with
+# an optional aggregate function, and an optional filter.  Specs with an
+# aggregate are grouped by the key.  Derived columns are sums of other columns
+# computed on the server, so an ensemble can take statistics of the sum itself
+# (the 90th percentile of a sum is not the sum of the 90th percentiles).
+EXTRACTION_SPECS = {
+    "building_inspection_needs": {
+        "table": "eqTractDmg", "key": "Tract", "inventory": "hzTract", "inventory_key": "Tract",
+        "columns": [("PDsSlightBC", "SUM"), ("PDsModerateBC", "SUM"), ("PDsExtensiveBC", "SUM"),
+                    ("PDsCompleteBC", "SUM")],
+        "derived": [("SL_MO_TOT", ["PDsSlightBC", "PDsModerateBC"])],
+        "where": "r.DmgMechType = 'STR'"},
+    "direct_economic_loss": {
+        "table": "eqTractEconLoss", "key": "Tract", "inventory": "hzTract", "inventory_key": "Tract",
+        "columns": [("TotalLoss", "SUM")]},
+    "estimated_debris": {
+        "table": "eqTract", "key": "Tract", "inventory": "hzTract", "inventory_key": "Tract",
+        "columns": [("DebrisS", None), ("DebrisC", None), ("DebrisTotal", None)]},
+    "highway_segments": {
+        "table": "eqHighwaySegment", "key": "HighwaySegID", "inventory": "hzHighwaySegment",
+        "inventory_key": "HighwaySegId",
+        "columns": [("PDsExceedModerate", None), ("FunctDay1", None), ("EconLoss", None)]},
+    "highway_bridges": {
+        "table": "eqHighwayBridge", "key": "HighwayBridgeID", "inventory": "hzHighwayBrdg",
+        "inventory_key": "HighwayBridgeId",
+        "columns": [("PDsExceedModerate", None), ("FunctDay1", None), ("EconLoss", None)]},
+    "hospitals": {
+        "table": "eqCareFlty", "key": "CareFltyID", "inventory": "hzCareFlty", "inventory_key": "CareFltyId",
+        "columns": [("PDsExceedModerate", None), ("FunctDay1", None), ("EconLoss", None)]},
+    "injuries": {
+        "table": "eqTractCasOccup", "key": "Tract", "inventory": "hzTract", "inventory_key": "Tract",
+        "columns": [("Level1Injury", "SUM"), ("Level2Injury", "SUM"), ("Level3Injury", "SUM"),
+                    ("Level4Injury", "SUM")],
+        "derived": [("SUM_2_3", ["Level2Injury", "Level3Injury"])],
+        "where": "r.CasTime = 'D' AND r.InOutTot = 'TOT'"},
+    "search_and_rescue_needs": {
+        "table": "eqTractDmg", "key": "Tract", "inventory": "hzTract", "inventory_key": "Tract",
+        "columns": [("PDsCompleteBC", "SUM")],
+        "where": "r.DmgMechType = 'STR'"},
+    "shelter_needs": {
+        "table": "eqTract", "key": "Tract", "inventory": "hzTract", "inventory_key": "Tract",
+        "columns": [("ShortTermShelter", None), ("DisplacedHouseholds", None), ("ExposedPeople", None),
+                    ("ExposedValue", None)]},
+    "electric_power_facilities": {
+        "table": "eqElectricPowerFlty", "key": "ElectricPowerFltyID", "inventory": "hzElectricPowerFlty",
+        "inventory_key": "ElectricPowerFltyId",
+        "columns": [("PDsExceedModerate", None), ("FunctDay1", None), ("EconLoss", None)]},
+    "natural_gas_facilities": {
+        "table": "eqNaturalGasFlty", "key": "NaturalGasFltyID", "inventory": "hzNaturalGasFlty",
+        "inventory_key": "NaturalGasFltyId",
+        "columns": [("PDsExceedModerate", None), ("FunctDay1", None), ("EconLoss", None)]},
+    "oil_facilities": {
+        "table": "eqOilFlty", "key": "OilFltyID", "inventory": "hzOilFlty", "inventory_key": "OilFltyId",
+        "columns": [("PDsExceedModerate", None), ("FunctDay1", None), ("EconLoss", None)]},
+    "water_infrastructure_damage": {
+        "table": "eqPotableWaterDL", "key": "Tract", "inventory": "hzTract", "inventory_key": "Tract",
+        "columns": [("TotalPipe", None), ("TotalNumRepairs", None), ("TotalDysRepairs", None),
+                    ("EconLoss", None), ("Cost", None)]},
+}
+
+# The extraction specs each map method runs
+MAP_EXTRACTIONS = {
+    "building_inspection_needs": ["building_inspection_needs"],
+    "direct_economic_loss": ["direct_economic_loss"],
+    "estimated_debris": ["estimated_debris"],
+    "highway_infrastructure_damage": ["highway_segments", "highway_bridges"],
+    "impaired_hospitals": ["hospitals", "injuries"],
+    "search_and_rescue_needs": ["search_and_rescue_needs"],
+    "shelter_needs": ["shelter_needs"],
+    "utility_damage": ["electric_power_facilities", "natural_gas_facilities", "oil_facilities"],
+    "water_infrastructure_damage": ["water_infrastructure_damage"],
+}
+
+
+def result_tables(map_method):
+    """Return the sorted names of the HAZUS result tables a map method reads."""
+    return sorted(set(EXTRACTION_SPECS[name]["table"] for name in MAP_EXTRACTIONS[map_method]))
+
+
+def build_sql(name):
+    """Return the extraction query for the named spec.  The key is always the
+    first column and every column keeps its name, so rows can be read by
+    position or by attribute (e.g., row.Tract)."""
+    spec = EXTRACTION_SPECS[name]
+    key = "r.[%s]" % spec["key"]
+    aggregated = any(function for column, function in spec["columns"])
+
+    select = ["%s AS [%s]" % (key, spec["key"])]
+    for column, function in spec["columns"]:
+        if function:
+            select.append("%s(r.[%s]) AS [%s]" % (function, column, column))
+        else:
+            select.append("r.[%s] AS [%s]" % (column, column))
+    for derived_name, columns in spec.get("derived", []):
+        expression = " + ".join("r.[%s]" % column for column in columns)
+        if aggregated:
+            expression = "SUM(%s)" % expression
+        select.append("%s AS [%s]" % (expression, derived_name))
+
+    sql = ["SELECT " + ", ".join(select),
+           "FROM [%s] r" % spec["table"],
+           "INNER JOIN [%s] i ON i.[%s] = %s" % (spec["inventory"], spec["inventory_key"], key)]
+    if spec.get("where"):
+        sql.append("WHERE " + spec["where"])
+    if aggregated:
+        sql.append("GROUP BY " + key)
+    sql.append("ORDER BY " + key)
+    return "\n".join(sql)
@@ -0,0 +1,130 @@
+# This module builds generalized copies of the census tract and highway
+# segment feature classes in the template geodatabase.  Regional layouts are
+# drawn at scales where full resolution tract boundaries and highway segments
+# cannot be seen, so exporting them only slows ExportToPDF and ExportToJPEG
+# down and makes the PDFs larger.
+#
+# The generalized geometry is built once, the first time a map needs it after
+# the template has been pruned to the study region.  When later maps write new
+# results, only the attributes of the copies are refreshed; the geometry is
+# rebuilt only if features were deleted from the source feature class.
+
+import os
+import time
+from arcpy import cartography
+from arcpy import management
+from arcpy import env
+from arcpy import da
+from arcpy import Exists
+from arcpy import ListFields
+
+import writeback
+
+# Scale bands as (largest scale denominator, simplification tolerance).  Maps
+# drawn at 1:100,000 or larger use the full resolution features.
+SCALE_BANDS = [(100000, None),
+               (500000, "25 Meters"),
+               (2000000, "100 Meters"),
+               (None, "400 Meters")]
+
+# Feature classes that have generalized copies, their geometry types and the
+# key used to copy attributes from the source feature class
+GENERALIZED_FCS = {"eqTract": ("POLYGON", "Tract"), "eqHighwaySegment": ("POLYLINE", "HighwaySegID")}
+
+# The workspace type replaceDataSource needs for each kind of geodatabase
+WORKSPACE_TYPES = {".mdb": "ACCESS_WORKSPACE", ".gdb": "FILEGDB_WORKSPACE"}
+
+
+def workspace_type(workspace):
+    """Return the replaceDataSource workspace type of a geodatabase path."""
+    return WORKSPACE_TYPES[os.path.splitext(workspace)[1].lower()]
+
+
+def tolerance_for_scale(scale):
+    """Return the simplification tolerance for a map scale, or None if the map
+    should use full resolution features."""
+    for max_scale, tolerance in SCALE_BANDS:
+        if max_scale is None or scale <= max_scale:
+            return tolerance
+
+
+def generalized_name(fc_name, tolerance):
+    """Return the name of the generalized copy of fc_name, e.g. eqTract_G25."""
+    return fc_name + "_G" + tolerance.split(" ")[0]
+
+
+class GeneralizedCache(object):
+    """Keeps track of the generalized feature classes stored in a geodatabase.
+    A copy is only built the first time it is needed.  Its attributes are
+    refreshed from the source feature class after new results are written, and
+    it is only rebuilt after features have been deleted from the source."""
+
+    def __init__(self, workspace, logger):
+        self.workspace = workspace
+        self.logger = logger
+        # {(fc_name, tolerance): generalized fc name}
+        self.cached = {}
+        # Generalized copies whose attributes are older than the source
+        self.stale = set()
+
+    def dataset_for_scale(self, fc_name, scale):
+        """Return the name of the feature class that a layer drawing fc_name at
+        the given scale should use."""
+        if fc_name not in GENERALIZED_FCS:
+            return fc_name
+        tolerance = tolerance_for_scale(scale)
+        if tolerance is None:
+            return fc_name
+        if (fc_name, tolerance) not in self.cached:
+            self.cached[(fc_name, tolerance)] = self.build(fc_name, tolerance)
+        elif (fc_name, tolerance) in self.stale:
+            self.refresh_attributes(fc_name, self.cached[(fc_name, tolerance)])
+        self.stale.discard((fc_name, tolerance))
+        return self.cached[(fc_name, tolerance)]
+
+    def build(self, fc_name, tolerance):
+        """Create a generalized copy of fc_name in the workspace."""
+        start = time.time()
+        in_fc = self.workspace + "\\" + fc_name
+        out_name = generalized_name(fc_name, tolerance)
+        out_fc = self.workspace + "\\" + out_name
+        env.overwriteOutput = True
+        if Exists(out_fc):
+            management.Delete(out_fc)
+        # Features that collapse at this tolerance are too small to see at the
+        # map scale, so they are dropped rather than kept in a *_Pnt feature class
+        if GENERALIZED_FCS[fc_name][0] == "POLYGON":
+            cartography.SimplifyPolygon(in_fc, out_fc, "POINT_REMOVE", tolerance, "0 SquareMeters",
+                                        "RESOLVE_ERRORS", "NO_KEEP")
+        else:
+            cartography.SimplifyLine(in_fc, out_fc, "POINT_REMOVE", tolerance, "RESOLVE_ERRORS", "NO_KEEP")
+        self.logger.info("Generalized %s at %s in %.1f seconds" % (fc_name, tolerance, time.time() - start))
+        return out_name
+
+    def refresh_attributes(self, fc_name, out_name):
+        """Copy the current attribute values of fc_name to its generalized copy
+        out_name, matching features on the key field."""
+        start = time.time()
+        in_fc = self.workspace + "\\" + fc_name
+        out_fc = self.workspace + "\\" + out_name
+        key_field = GENERALIZED_FCS[fc_name][1]
+        out_fields = set(f.name.lower() for f in ListFields(out_fc))
+        fields = [f.name for f in ListFields(in_fc)
+                  if f.editable and f.type not in ("OID", "Geometry") and f.name.lower() in out_fields and
+                  f.name.lower() != key_field.lower()]
+        with da.SearchCursor(in_fc, [key_field] + fields, sql_clause=(None, "ORDER BY " + key_field)) as rows:
+            source_rows = [row for row in rows]
+        writeback.ordered_update(out_fc, key_field, fields, source_rows, lambda row: row[1:])
+        self.logger.info("Refreshed the attributes of %s in %.1f seconds" % (out_name, time.time() - start))
+
+    def source_changed(self, fc_name, deleted_rows):
+        """Record that new results were written to fc_name.  If features were
+        deleted, its generalized copies are rebuilt the next time they are
+        needed; otherwise only their attributes are refreshed."""
+        for key in list(self.cached):
+            if key[0] == fc_name:
+                if deleted_rows:
+                    del self.cached[key]
+                    self.stale.discard(key)
+                else:
+                    self.stale.add(key)
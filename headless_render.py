@@ -0,0 +1,273 @@
+# This module draws the nine HAZUS Map Generator products without arcpy, so
+# maps can be rendered on Linux compute nodes during a large event.  It reads
+# the populated feature classes (the StudyRegionData.mdb written by the map
+# generator, or a copy of it in any format GDAL can read, e.g. a file
+# geodatabase or GeoPackage) and draws them with the class breaks and colors
+# from Template/Data/*.lyr.  Maps are rendered in parallel, one per process.
+#
+# The MXD templates are still needed for the original page layouts; these
+# maps only show the data frame, a title and a legend.
+#
+# Usage:
+#   python headless_render.py <data source> <output dir> [<map> ...] [--processes <n>] [--dpi <n>]
+#
+# Dependencies: geopandas, shapely, numpy and matplotlib
+
+import argparse
+import multiprocessing
+import os
+import zlib
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+from matplotlib.lines import Line2D
+from matplotlib.patches import Patch
+import geopandas
+import numpy
+
+# Symbology transcribed from the layer files in Template/Data.  Dot density
+# layers draw one dot for every dot_value units in each tract; class layers
+# color each feature by the class its value falls in.  Class breaks are the
+# upper bounds of each class, listed from lowest to highest.
+YELLOW_TO_DARK_RED = ["#ffff80", "#f59d3d", "#a80000"]
+
+LAYER_STYLES = {
+    "GreenTagBuildings": {"fc": "eqTract", "field": "SL_MO_TOT", "renderer": "dots", "dot_value": 100,
+                          "color": "#38a800", "label": "Green Tag (1 dot = 100 buildings)"},
+    "YellowTagBuildings": {"fc": "eqTract", "field": "PDsExtensiveBC", "renderer": "dots", "dot_value": 100,
+                           "color": "#e6c800", "label": "Yellow Tag (1 dot = 100 buildings)"},
+    "RedTagBuildings": {"fc": "eqTract", "field": "PDsCompleteBC", "renderer": "dots", "dot_value": 100,
+                        "color": "#e60000", "label": "Red Tag (1 dot = 100 buildings)"},
+    "TotalEconLoss": {"fc": "eqTract", "field": "TotalEconLoss", "renderer": "dots", "dot_value": 1000,
+                      "color": "#2b8a3e", "label": "Direct economic loss (1 dot = 1,000)"},
+    "DebrisS": {"fc": "eqTract", "field": "DebrisS", "renderer": "dots", "dot_value": 5,
+                "color": "#8c6d31", "label": "Concrete and steel debris (1 dot = 5 tons)"},
+    "DisplacedHouseholds": {"fc": "eqTract", "field": "DisplacedHouseholds", "renderer": "dots", "dot_value": 5,
+                            "color": "#e67e22", "label": "Displaced households (1 dot = 5)"},
+    "ShortTermShelter": {"fc": "eqTract", "field": "ShortTermShelter", "renderer": "dots", "dot_value": 5,
+                         "color": "#1f78b4", "label": "Public shelter (1 dot = 5 people)"},
+    "LifeThreateningInjuries": {"fc": "eqTract", "field": "SUM_2_3", "renderer": "dots", "dot_value": 5,
+                                "color": "#c0392b", "label": "Life threatening injuries (1 dot = 5)"},
+    "eqHighwaySegment": {"fc": "eqHighwaySegment", "field": "PDsExceedModerate", "renderer": "classes",
+                         "breaks": [0.25, 0.75, 1.0], "colors": YELLOW_TO_DARK_RED,
+                         "labels": ["0 - 25%", "25 - 75%", "75 - 100%"], "label": "Highway segments"},
+    "eqHighwayBridge": {"fc": "eqHighwayBridge", "field": "PDsExceedModerate", "renderer": "classes",
+                        "breaks": [0.25, 0.75, 1.0], "colors": YELLOW_TO_DARK_RED,
+                        "labels": ["0 - 25%", "25 - 75%", "75 - 100%"], "label": "Bridges"},
+    "eqCareFlty": {"fc": "eqCareFlty", "field": "FunctDay1", "renderer": "classes",
+                   "breaks": [25.0, 75.0, 100.0], "colors": list(reversed(YELLOW_TO_DARK_RED)),
+                   "labels": ["0 - 25%", "25 - 75%", "75 - 100%"], "label": "Hospital functionality, day 1"},
+    "eqElectricPowerFlty": {"fc": "eqElectricPowerFlty", "field": "PDsExceedModerate", "renderer": "classes",
+                            "breaks": [0.25, 0.75, 1.0], "colors": YELLOW_TO_DARK_RED,
+                            "labels": ["0 - 25%", "25 - 75%", "75 - 100%"], "label": "Electric power facilities",
+                            "marker": "s"},
+    "eqNaturalGasFlty": {"fc": "eqNaturalGasFlty", "field": "PDsExceedModerate", "renderer": "classes",
+                         "breaks": [0.25, 0.75, 1.0], "colors": YELLOW_TO_DARK_RED,
+                         "labels": ["0 - 25%", "25 - 75%", "75 - 100%"], "label": "Natural gas facilities",
+                         "marker": "^"},
+    "eqOilFlty": {"fc": "eqOilFlty", "field": "PDsExceedModerate", "renderer": "classes",
+                  "breaks": [0.25, 0.75, 1.0], "colors": YELLOW_TO_DARK_RED,
+                  "labels": ["0 - 25%", "25 - 75%", "75 - 100%"], "label": "Oil facilities", "marker": "D"},
+    "eqPotableWaterDL": {"fc": "eqPotableWaterDL", "field": "EconLoss", "renderer": "classes",
+                         "breaks": [50000.0, 100000.0, 500000.0, 1000000.0, 5000000.0],
+                         "colors": ["#fee5d9", "#fcae91", "#fb6a4a", "#de2d26", "#a50f15"],
+                         "labels": ["0 - 50,000", "50,000 - 100,000", "100,000 - 500,000",
+                                    "500,000 - 1,000,000", "1,000,000 - 5,000,000"],
+                         "label": "Potable water economic loss ($)"},
+}
+
+# {map function name: (output name, title, layers drawn from bottom to top)}
+MAP_PRODUCTS = {
+    "building_inspection_needs": ("BuildingInspectionNeeds", "Building Inspection Needs",
+                                  ["GreenTagBuildings", "YellowTagBuildings", "RedTagBuildings"]),
+    "direct_economic_loss": ("DirectEconomicLoss", "Direct Building Economic Loss", ["TotalEconLoss"]),
+    "estimated_debris": ("EstimatedDebris", "Estimated Concrete and Steel Debris", ["DebrisS"]),
+    "highway_infrastructure_damage": ("HighwayInfrastructureDamage", "Highway Infrastructure Damage",
+                                      ["eqHighwaySegment", "eqHighwayBridge"]),
+    "impaired_hospitals": ("ImpairedHospitals", "Impaired Hospitals", ["LifeThreateningInjuries", "eqCareFlty"]),
+    "search_and_rescue_needs": ("SearchandRescueNeeds", "Search and Rescue Needs", ["RedTagBuildings"]),
+    "shelter_needs": ("ShelterNeeds", "Displaced Households and Shelter Needs",
+                      ["DisplacedHouseholds", "ShortTermShelter"]),
+    "utility_damage": ("UtilityDamage", "Utility Damage",
+                       ["eqElectricPowerFlty", "eqNaturalGasFlty", "eqOilFlty"]),
+    "water_infrastructure_damage": ("WaterInfrastructureDamage", "Potable Water Economic Loss",
+                                    ["eqPotableWaterDL"]),
+}
+
+
+def read_layer(source, fc):
+    """Read a feature class from the data source as a GeoDataFrame."""
+    return geopandas.read_file(source, layer=fc)
+
+
+def _contains(geometry, xs, ys):
+    try:
+        from shapely import contains_xy
+        return contains_xy(geometry, xs, ys)
+    except ImportError:
+        from shapely.vectorized import contains
+        return contains(geometry, xs, ys)
+
+
+def feature_seed(key, field):
+    """Return a random seed for the dots of one feature.  It depends only on
+    the feature's key and the field, so the dots of a tract only move when that
+    tract's value changes."""
+    return zlib.crc32(("%s|%s" % (key, field)).encode("utf-8")) & 0xffffffff
+
+
+def dot_density_points(gdf, field, dot_value, key_field="Tract"):
+    """Return arrays of x and y coordinates with one random dot inside each
+    polygon for every dot_value units in field.  Each polygon gets its own
+    random generator, seeded from its key_field value (or its position if the
+    layer has no such field), so the same data always produces the same dots
+    and a change in one polygon does not move the dots of any other."""
+    if key_field in gdf.columns:
+        keys = gdf[key_field]
+    else:
+        keys = range(len(gdf))
+    xs = []
+    ys = []
+    for key, geometry, value in zip(keys, gdf.geometry, gdf[field]):
+        if geometry is None or geometry.is_empty or value is None or numpy.isnan(value):
+            continue
+        count = int(round(value / float(dot_value)))
+        if count <= 0:
+            continue
+        rng = numpy.random.RandomState(feature_seed(key, field))
+        minx, miny, maxx, maxy = geometry.bounds
+        placed = 0
+        # Draw candidate points in the bounding box until enough fall inside
+        while placed < count:
+            batch = max(2 * (count - placed), 16)
+            cx = rng.uniform(minx, maxx, batch)
+            cy = rng.uniform(miny, maxy, batch)
+            inside = _contains(geometry, cx, cy)
+            cx = cx[inside][:count - placed]
+            cy = cy[inside][:count - placed]
+            xs.append(cx)
+            ys.append(cy)
+            placed += len(cx)
+    if not xs:
+        return numpy.array([]), numpy.array([])
+    return numpy.concatenate(xs), numpy.concatenate(ys)
+
+
+def classify(values, breaks):
+    """Return the class index of each value, or -1 for NULL values."""
+    values = numpy.asarray(values, dtype=float)
+    classes = numpy.searchsorted(numpy.asarray(breaks), values, side="left")
+    classes = numpy.minimum(classes, len(breaks) - 1)
+    classes[numpy.isnan(values)] = -1
+    return classes
+
+
+def draw_layer(ax, gdf, style, marker_size=12, dot_size=1.5):
+    """Draw one styled layer on a matplotlib axis and return its legend handles."""
+    if style["renderer"] == "dots":
+        xs, ys = dot_density_points(gdf, style["field"], style["dot_value"])
+        ax.scatter(xs, ys, s=dot_size, c=style["color"], linewidths=0)
+        return [Line2D([], [], linestyle="", marker="o", markersize=4, color=style["color"],
+                       label=style["label"])]
+
+    classes = classify(gdf[style["field"]], style["breaks"])
+    geom_type = gdf.geom_type.iloc[0] if len(gdf) else "Point"
+    handles = []
+    for i, color in enumerate(style["colors"]):
+        subset = gdf[classes == i]
+        if geom_type in ("Point", "MultiPoint"):
+            if len(subset):
+                subset.plot(ax=ax, color=color, markersize=marker_size, marker=style.get("marker", "o"),
+                            edgecolor="#404040", linewidth=0.3)
+            handles.append(Line2D([], [], linestyle="", marker=style.get("marker", "o"), markersize=6,
+                                  markerfacecolor=color, markeredgecolor="#404040",
+                                  label=style["labels"][i]))
+        elif geom_type in ("LineString", "MultiLineString"):
+            if len(subset):
+                subset.plot(ax=ax, color=color, linewidth=1.2)
+            handles.append(Line2D([], [], color=color, linewidth=2, label=style["labels"][i]))
+        else:
+            if len(subset):
+                subset.plot(ax=ax, color=color, edgecolor="#808080", linewidth=0.2)
+            handles.append(Patch(facecolor=color, edgecolor="#808080", label=style["labels"][i]))
+    handles.insert(0, Patch(facecolor="none", edgecolor="none", label=style["label"]))
+    return handles
+
+
+def map_extent(source):
+    """Return the (xmin, ymin, xmax, ymax) extent of the study region tracts."""
+    return tuple(read_layer(source, "eqTract").total_bounds)
+
+
+def render_map(source, map_function, out_dir, extent=None, dpi=200):
+    """Render a single map product to a PDF and a PNG in out_dir and return the
+    paths of the files written."""
+    map_name, title, layers = MAP_PRODUCTS[map_function]
+    tracts = read_layer(source, "eqTract")
+    if extent is None:
+        extent = tuple(tracts.total_bounds)
+
+    fig, ax = plt.subplots(figsize=(11, 8.5))
+    tracts.boundary.plot(ax=ax, color="#b0b0b0", linewidth=0.3)
+    handles = []
+    layer_cache = {"eqTract": tracts}
+    for layer in layers:
+        style = LAYER_STYLES[layer]
+        if style["fc"] not in layer_cache:
+            layer_cache[style["fc"]] = read_layer(source, style["fc"])
+        handles.extend(draw_layer(ax, layer_cache[style["fc"]], style))
+
+    ax.set_xlim(extent[0], extent[2])
+    ax.set_ylim(extent[1], extent[3])
+    ax.set_aspect("equal")
+    ax.set_axis_off()
+    ax.set_title(title, fontsize=16)
+    ax.legend(handles=handles, loc="lower left", fontsize=8, frameon=True)
+
+    written = []
+    for folder, extension in (("PDF", ".pdf"), ("PNG", ".png")):
+        folder_path = os.path.join(out_dir, folder)
+        if not os.path.isdir(folder_path):
+            os.makedirs(folder_path)
+        out_file = os.path.join(folder_path, map_name + extension)
+        fig.savefig(out_file, dpi=dpi, bbox_inches="tight")
+        written.append(out_file)
+    plt.close(fig)
+    return written
+
+
+def _render_map_args(args):
+    return render_map(*args)
+
+
+def render_maps(source, map_functions, out_dir, processes=None, dpi=200):
+    """Render several map products in parallel, one per worker process, and
+    return the paths of all of the files written."""
+    extent = map_extent(source)
+    tasks = [(source, m, out_dir, extent, dpi) for m in map_functions]
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(_render_map_args, tasks)
+    finally:
+        pool.close()
+        pool.join()
+    return [path for paths in results for path in paths]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render HAZUS Map Generator products without arcpy")
+    parser.add_argument("source", help="populated StudyRegionData geodatabase or a copy GDAL can read")
+    parser.add_argument("out_dir")
+    parser.add_argument("maps", nargs="*", help="map functions to render, e.g. shelter_needs (default: all)")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--dpi", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    maps = args.maps or sorted(MAP_PRODUCTS)
+    for path in render_maps(args.source, maps, args.out_dir, args.processes, args.dpi):
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
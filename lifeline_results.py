@@ -0,0 +1,79 @@
+# This module holds lifeline query results (highway segments, bridges, care
+# facilities and utility facilities) in a compact columnar form.  Instead of
+# keeping a full list of pyodbc Row objects, the IDs are kept in a plain list
+# (facility and segment IDs are unique, so there is nothing to share) and the
+# PDsExceedModerate, FunctDay1 and EconLoss columns are stored as typed arrays
+# of doubles.
+
+import sys
+from array import array
+
+# NULL values from SQL Server are stored as NaN in the typed arrays
+NULL = float("nan")
+
+
+def _to_double(value):
+    if value is None:
+        return NULL
+    return float(value)
+
+
+def _from_double(value):
+    # NaN is the only value that is not equal to itself
+    if value != value:
+        return None
+    return value
+
+
+class LifelineResults(object):
+    """Columnar storage for rows of ID, PDsExceedModerate, FunctDay1 and EconLoss
+    returned from one of the HAZUS lifeline result tables.  Iterating over the
+    results yields (id, pds_exceed_moderate, funct_day1, econ_loss) tuples with
+    NULL values returned as None."""
+
+    def __init__(self, table):
+        self.table = table
+        self.ids = []
+        self.pds_exceed_moderate = array("d")
+        self.funct_day1 = array("d")
+        self.econ_loss = array("d")
+
+    @classmethod
+    def from_cursor(cls, cursor, table, batch_size=5000):
+        """Build the results from a pyodbc cursor that has already executed a
+        query returning the ID, PDsExceedModerate, FunctDay1 and EconLoss
+        columns in that order.  Rows are fetched in batches so that only
+        batch_size Row objects are in memory at a time."""
+        results = cls(table)
+        rows = cursor.fetchmany(batch_size)
+        while rows:
+            for row in rows:
+                results.append(row[0], row[1], row[2], row[3])
+            rows = cursor.fetchmany(batch_size)
+        return results
+
+    def append(self, flty_id, pds_exceed_moderate, funct_day1, econ_loss):
+        """Add a single row to the results."""
+        self.ids.append(flty_id)
+        self.pds_exceed_moderate.append(_to_double(pds_exceed_moderate))
+        self.funct_day1.append(_to_double(funct_day1))
+        self.econ_loss.append(_to_double(econ_loss))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        for i in range(len(self.ids)):
+            yield (self.ids[i],
+                   _from_double(self.pds_exceed_moderate[i]),
+                   _from_double(self.funct_day1[i]),
+                   _from_double(self.econ_loss[i]))
+
+    def memory_usage(self):
+        """Return the approximate number of bytes used to hold the results."""
+        total = sys.getsizeof(self.ids)
+        for flty_id in self.ids:
+            total += sys.getsizeof(flty_id)
+        for column in (self.pds_exceed_moderate, self.funct_day1, self.econ_loss):
+            total += column.itemsize * len(column)
+        return total
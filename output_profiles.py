@@ -0,0 +1,80 @@
+# This module defines the named output profiles used when the maps are
+# exported.  A profile sets the PDF and JPEG export options in one place, so
+# field teams on satellite or cellular links can get small files straight out
+# of the export instead of re-compressing them afterwards.
+
+import csv
+import os
+import time
+
+# The "print" profile matches the settings the maps have always been exported
+# with.  Its files keep the plain map name; other profiles add a suffix, e.g.
+# ShelterNeeds_field.pdf.
+DEFAULT_PROFILE = "print"
+
+OUTPUT_PROFILES = {
+    "print": {
+        "pdf": {"resolution": 300, "image_quality": "BEST", "compress_vectors": True,
+                "image_compression": "ADAPTIVE", "picture_symbol": "RASTERIZE_BITMAP",
+                "convert_markers": False, "embed_fonts": True, "layers_attributes": "LAYERS_ONLY",
+                "jpeg_compression_quality": 80},
+        "jpeg": {"resolution": 200, "jpeg_quality": 100, "progressive": False},
+    },
+    "briefing": {
+        "pdf": {"resolution": 150, "image_quality": "NORMAL", "compress_vectors": True,
+                "image_compression": "JPEG", "picture_symbol": "RASTERIZE_BITMAP",
+                "convert_markers": True, "embed_fonts": True, "layers_attributes": "NONE",
+                "jpeg_compression_quality": 70},
+        "jpeg": {"resolution": 150, "jpeg_quality": 80, "progressive": False},
+    },
+    "field": {
+        "pdf": {"resolution": 96, "image_quality": "FASTER", "compress_vectors": True,
+                "image_compression": "JPEG", "picture_symbol": "RASTERIZE_PICTURE",
+                "convert_markers": True, "embed_fonts": False, "layers_attributes": "NONE",
+                "jpeg_compression_quality": 40},
+        "jpeg": {"resolution": 96, "jpeg_quality": 50, "progressive": True},
+    },
+}
+
+
+def output_name(map_name, profile):
+    """Return the file name (without extension) for a map exported with a profile."""
+    if profile == DEFAULT_PROFILE:
+        return map_name
+    return map_name + "_" + profile
+
+
+def export_map(current_map, map_name, pdf_out_dir, jpeg_out_dir, profile):
+    """Export a map document as a PDF and a JPEG using the settings of the named
+    profile.  Returns a list of (map name, profile, format, seconds, bytes)
+    tuples, one for each file written."""
+    # arcpy is imported here so the profiles can be checked on machines
+    # without ArcGIS (see render_queue.validate_job)
+    from arcpy import mapping
+    settings = OUTPUT_PROFILES[profile]
+    name = output_name(map_name, profile)
+    stats = []
+
+    pdf = pdf_out_dir + "\\" + name + ".pdf"
+    start = time.time()
+    mapping.ExportToPDF(current_map, pdf, **settings["pdf"])
+    stats.append((map_name, profile, "PDF", time.time() - start, os.path.getsize(pdf)))
+
+    jpeg = jpeg_out_dir + "\\" + name + ".jpeg"
+    start = time.time()
+    mapping.ExportToJPEG(current_map, jpeg, **settings["jpeg"])
+    stats.append((map_name, profile, "JPEG", time.time() - start, os.path.getsize(jpeg)))
+    return stats
+
+
+def write_export_stats(stats, out_dir):
+    """Write export statistics to ExportStats.csv in out_dir.  The stats
+    parameter is a dictionary of {(map name, profile, format): (seconds, bytes)}."""
+    out_csv = os.path.join(out_dir, "ExportStats.csv")
+    with open(out_csv, "wb") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Map", "Profile", "Format", "Seconds", "Bytes"])
+        for key in sorted(stats):
+            seconds, size = stats[key]
+            writer.writerow(list(key) + ["%.2f" % seconds, size])
+    return out_csv
@@ -0,0 +1,353 @@
+# This module runs the HAZUS Map Generator as a shared render service.  Analysts
+# drop map generation jobs into a spool directory (usually a network share) and
+# a single render host works through them with a bounded pool of workers, so
+# only that machine needs the arcpy licenses and the CPU time.
+#
+# The spool directory has one folder for each job state:
+#   pending\  jobs waiting for a worker
+#   running\  jobs a worker has claimed
+#   done\     jobs that finished
+#   failed\   jobs that finished with an error
+# plus output\ for the maps and logs\ for the output of each job.
+#
+# A claimed job records the host and process ID of the service running it.  If
+# that service dies, the job is put back in pending\ the next time a service
+# starts on that host (or when the same job is submitted again).
+#
+# Usage:
+#   python render_queue.py submit <spool> <server> <database> "<map>" ["<map>" ...] [--profile <profile> ...]
+#                                [--ensemble <scenario database> ... --statistic <statistic>]
+#   python render_queue.py status <spool> [<job id>]
+#   python render_queue.py serve <spool> [--workers <n>]
+
+import argparse
+import ctypes
+import errno
+import hashlib
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import ensemble_statistics
+import output_profiles
+import result_watch
+
+JOB_STATES = ["pending", "running", "done", "failed"]
+
+# How long an idle worker waits before checking the spool directory again
+POLL_INTERVAL_SECONDS = 5
+
+# A running job claimed by another host is only considered abandoned after
+# this long, since its process cannot be checked from here
+STALE_JOB_SECONDS = 24 * 60 * 60
+
+
+def map_method(map_name):
+    """Return the name of the function that creates a map, e.g. Shelter Needs ->
+    shelter_needs."""
+    return str(map_name.lower().replace(" ", "_"))
+
+
+def validate_job(job):
+    """Raise ValueError if a job names a map, profile or statistic that does not
+    exist, so the mistake is reported when the job is submitted rather than
+    after the template has been copied and the results written."""
+    if not job.get("maps"):
+        raise ValueError("No maps were given")
+    for map_name in job["maps"]:
+        if map_method(map_name) not in result_watch.MAP_DEPENDENCIES:
+            raise ValueError("Unknown map: " + map_name)
+    for profile in job.get("profile") or []:
+        if profile not in output_profiles.OUTPUT_PROFILES:
+            raise ValueError("Unknown output profile: " + profile)
+    if job.get("statistic"):
+        if not job.get("ensemble"):
+            raise ValueError("A statistic was given without any ensemble databases")
+        if job["statistic"] not in ensemble_statistics.STATISTICS:
+            raise ValueError("Unknown ensemble statistic: " + job["statistic"])
+
+
+def process_alive(pid):
+    """Return True if a process with the given ID is running on this machine."""
+    if sys.platform == "win32":
+        kernel32 = ctypes.windll.kernel32
+        process_query_limited_information = 0x1000
+        still_active = 259
+        handle = kernel32.OpenProcess(process_query_limited_information, False, pid)
+        if not handle:
+            # Access is denied for processes that exist but belong to someone else
+            return kernel32.GetLastError() == 5
+        try:
+            exit_code = ctypes.c_ulong()
+            kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+            return exit_code.value == still_active
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def job_id(job):
+    """Return an ID for a job based on its contents.  Identical jobs get the
+    same ID, which is how duplicate pending jobs are detected."""
+    key = json.dumps([job["server"], job["database"], sorted(job["maps"]),
+                      sorted(job.get("profile") or []), sorted(job.get("ensemble") or []),
+                      job.get("statistic")])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+class SpoolQueue(object):
+    """A job queue stored as JSON files in a spool directory.  Moving a job
+    between state folders is done with os.rename, so several processes can
+    share the same spool directory without any other locking."""
+
+    def __init__(self, spool_dir):
+        self.spool_dir = spool_dir
+        for folder in JOB_STATES + ["output", "logs"]:
+            path = os.path.join(spool_dir, folder)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+    def job_path(self, state, jid):
+        return os.path.join(self.spool_dir, state, jid + ".json")
+
+    def submit(self, job):
+        """Add a job to the queue and return its ID.  If an identical job is
+        already pending or running, the existing job ID is returned instead; an
+        identical job left running by a service that died is put back in
+        pending.  Raises ValueError if the job is not valid."""
+        validate_job(job)
+        jid = job_id(job)
+        if os.path.exists(self.job_path("pending", jid)):
+            return jid
+        if os.path.exists(self.job_path("running", jid)):
+            try:
+                running_job = self.read("running", jid)
+            except (IOError, OSError, ValueError):
+                # The job finished or is being claimed right now
+                return jid
+            if self.is_stale(running_job):
+                self.requeue(running_job)
+            return jid
+
+        # Forget the previous result of this job so its status is current
+        for state in ["done", "failed"]:
+            if os.path.exists(self.job_path(state, jid)):
+                os.remove(self.job_path(state, jid))
+
+        record = dict(job)
+        record["id"] = jid
+        record["state"] = "pending"
+        record["submitted"] = time.time()
+        temp_path = os.path.join(self.spool_dir, "pending", jid + ".tmp")
+        with open(temp_path, "w") as f:
+            json.dump(record, f, indent=2, sort_keys=True)
+        try:
+            os.rename(temp_path, self.job_path("pending", jid))
+        except OSError:
+            # Another analyst submitted the same job at the same moment
+            os.remove(temp_path)
+        return jid
+
+    def claim(self):
+        """Move the oldest pending job to running and return it, or return None
+        if there are no pending jobs."""
+        pending_dir = os.path.join(self.spool_dir, "pending")
+        names = [n for n in os.listdir(pending_dir) if n.endswith(".json")]
+        names.sort(key=lambda n: os.path.getmtime(os.path.join(pending_dir, n)))
+        for name in names:
+            jid = name[:-len(".json")]
+            try:
+                os.rename(self.job_path("pending", jid), self.job_path("running", jid))
+            except OSError:
+                # Another worker claimed this job first
+                continue
+            job = self.read("running", jid)
+            job["state"] = "running"
+            job["started"] = time.time()
+            job["host"] = socket.gethostname()
+            job["pid"] = os.getpid()
+            self.write("running", job)
+            return job
+        return None
+
+    def is_stale(self, job):
+        """Return True if a running job was claimed by a service that is no
+        longer running."""
+        if job.get("host") == socket.gethostname():
+            return not process_alive(job.get("pid"))
+        return time.time() - job.get("started", 0) > STALE_JOB_SECONDS
+
+    def requeue(self, job):
+        """Move a running job back to pending so another worker can claim it."""
+        try:
+            os.rename(self.job_path("running", job["id"]), self.job_path("pending", job["id"]))
+        except OSError:
+            # The job finished or was requeued by someone else
+            return False
+        for detail in ["host", "pid", "started", "output_directory"]:
+            job.pop(detail, None)
+        job["state"] = "pending"
+        job["requeued"] = job.get("requeued", 0) + 1
+        self.write("pending", job)
+        return True
+
+    def recover(self):
+        """Put every stale running job back in pending and return their IDs."""
+        recovered = []
+        running_dir = os.path.join(self.spool_dir, "running")
+        for name in sorted(os.listdir(running_dir)):
+            if not name.endswith(".json"):
+                continue
+            try:
+                job = self.read("running", name[:-len(".json")])
+            except (IOError, OSError, ValueError):
+                continue
+            if self.is_stale(job) and self.requeue(job):
+                recovered.append(job["id"])
+        return recovered
+
+    def finish(self, job, succeeded, **details):
+        """Move a running job to done or failed and record the details."""
+        state = "done" if succeeded else "failed"
+        job.update(details)
+        job["state"] = state
+        job["finished"] = time.time()
+        self.write(state, job)
+        os.remove(self.job_path("running", job["id"]))
+
+    def read(self, state, jid):
+        with open(self.job_path(state, jid)) as f:
+            return json.load(f)
+
+    def write(self, state, job):
+        with open(self.job_path(state, job["id"]), "w") as f:
+            json.dump(job, f, indent=2, sort_keys=True)
+
+    def status(self, jid):
+        """Return the job record for a job ID, or None if the job is unknown."""
+        for state in JOB_STATES:
+            if os.path.exists(self.job_path(state, jid)):
+                return self.read(state, jid)
+        return None
+
+    def jobs(self):
+        """Return the records of all jobs in the queue."""
+        records = []
+        for state in JOB_STATES:
+            for name in sorted(os.listdir(os.path.join(self.spool_dir, state))):
+                if name.endswith(".json"):
+                    records.append(self.read(state, name[:-len(".json")]))
+        return records
+
+
+class RenderService(object):
+    """Works through the jobs in a SpoolQueue with a fixed number of worker
+    threads.  Each job runs in its own HAZUS_Map_Automation.py process so that
+    a failed job cannot take the service down with it."""
+
+    def __init__(self, queue, workers=2, command=None):
+        self.queue = queue
+        self.workers = workers
+        if command is None:
+            script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "HAZUS_Map_Automation.py")
+            command = [sys.executable, script, "--job"]
+        self.command = command
+        self.stopped = threading.Event()
+
+    def run_job(self, job):
+        """Run a single job and record the result in the queue."""
+        output_directory = os.path.join(self.queue.spool_dir, "output", job["id"])
+        if os.path.isdir(output_directory):
+            shutil.rmtree(output_directory)
+        os.makedirs(output_directory)
+        job["output_directory"] = output_directory
+        self.queue.write("running", job)
+
+        log_path = os.path.join(self.queue.spool_dir, "logs", job["id"] + ".txt")
+        with open(log_path, "w") as log:
+            returncode = subprocess.call(self.command + [self.queue.job_path("running", job["id"])],
+                                         stdout=log, stderr=subprocess.STDOUT)
+        self.queue.finish(job, returncode == 0, returncode=returncode, log=log_path)
+
+    def work(self):
+        """Claim and run jobs until the service is stopped."""
+        while not self.stopped.is_set():
+            job = self.queue.claim()
+            if job is None:
+                self.stopped.wait(POLL_INTERVAL_SECONDS)
+                continue
+            self.run_job(job)
+
+    def serve(self):
+        """Put back any jobs abandoned by an earlier service, then start the
+        worker threads and wait for them to finish."""
+        for jid in self.queue.recover():
+            print("Requeued abandoned job " + jid)
+        threads = [threading.Thread(target=self.work) for i in range(self.workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(1)
+        except KeyboardInterrupt:
+            self.stopped.set()
+
+    def stop(self):
+        self.stopped.set()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shared render queue for the HAZUS Map Generator")
+    commands = parser.add_subparsers(dest="command")
+
+    submit = commands.add_parser("submit", help="add a map generation job to the queue")
+    submit.add_argument("spool")
+    submit.add_argument("server")
+    submit.add_argument("database")
+    submit.add_argument("maps", nargs="+", help='map names as shown in the window, e.g. "Shelter Needs"')
+    submit.add_argument("--profile", action="append", default=None,
+                        help="output profile to export with; repeat to export several profiles")
+    submit.add_argument("--ensemble", action="append", default=None,
+                        help="scenario database to include in an ensemble; repeat for each scenario.  "
+                             "The database argument is then only used to name the output folder.")
+    submit.add_argument("--statistic", default=None, help="ensemble statistic: mean, max, min, p10, p50 or p90")
+
+    status = commands.add_parser("status", help="show the status of one or all jobs")
+    status.add_argument("spool")
+    status.add_argument("job_id", nargs="?")
+
+    serve = commands.add_parser("serve", help="run jobs from the queue on this machine")
+    serve.add_argument("spool")
+    serve.add_argument("--workers", type=int, default=2)
+
+    args = parser.parse_args(argv)
+    queue = SpoolQueue(args.spool)
+    if args.command == "submit":
+        job = {"server": args.server, "database": args.database, "maps": args.maps, "profile": args.profile,
+               "ensemble": args.ensemble, "statistic": args.statistic}
+        try:
+            print(queue.submit(job))
+        except ValueError as e:
+            parser.error(str(e))
+    elif args.command == "status":
+        if args.job_id:
+            records = [queue.status(args.job_id)]
+        else:
+            records = queue.jobs()
+        print(json.dumps(records, indent=2, sort_keys=True))
+    elif args.command == "serve":
+        RenderService(queue, args.workers).serve()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# This module lets the HAZUS Map Generator watch a study region database for
+# new analysis results.  Each map depends on a handful of HAZUS result tables;
+# the watcher keeps a cheap checksum of each of those tables and reports which
+# maps need to be regenerated when one of the checksums changes.
+
+import extraction_sql
+
+# How often the study region database is polled in watch mode
+WATCH_INTERVAL_SECONDS = 60
+
+# The HAZUS result tables that each map method reads, taken from the
+# extraction queries.  The inventory tables they join to only change when the
+# study region is rebuilt, so they are not watched.
+MAP_DEPENDENCIES = dict((map_method, extraction_sql.result_tables(map_method))
+                        for map_method in extraction_sql.MAP_EXTRACTIONS)
+
+
+def table_checksums(cursor, tables):
+    """Return a dictionary of {table: (row count, checksum)} for the tables.
+    All of the tables are checked with a single query so polling only costs
+    one round trip to the server."""
+    if not tables:
+        return {}
+    checksum_sql = " UNION ALL ".join(
+        "SELECT '%s', COUNT_BIG(*), CHECKSUM_AGG(BINARY_CHECKSUM(*)) FROM [%s]" % (table, table)
+        for table in sorted(tables))
+    cursor.execute(checksum_sql)
+    checksums = {}
+    for row in cursor.fetchall():
+        checksums[row[0]] = (row[1], row[2])
+    return checksums
+
+
+class ResultWatcher(object):
+    """Tracks the checksums of the result tables used by a set of maps."""
+
+    def __init__(self, maps):
+        self.maps = list(maps)
+        self.tables = set()
+        for m in self.maps:
+            self.tables.update(MAP_DEPENDENCIES[m])
+        self.checksums = {}
+
+    def snapshot(self, cursor):
+        """Record the current checksums as the baseline to compare against."""
+        self.checksums = table_checksums(cursor, self.tables)
+
+    def changed_maps(self, cursor):
+        """Return the maps whose result tables have changed since the last
+        call, in the same order the maps were given, and update the baseline."""
+        checksums = table_checksums(cursor, self.tables)
+        changed_tables = set(t for t in self.tables if checksums.get(t) != self.checksums.get(t))
+        self.checksums = checksums
+        return [m for m in self.maps if changed_tables.intersection(MAP_DEPENDENCIES[m])]
@@ -0,0 +1,143 @@
+# This module accumulates summary statistics while the HAZUS Map Generator
+# writes query results back into the template geodatabase.  Every value is
+# folded into running totals as it is written, so the reports in the
+# Summary_Reports folder never need another query against the HAZUS database.
+
+import csv
+import heapq
+import json
+import os
+
+# Fields of the tract tables that get a "top N tracts" table in the summary
+# reports.  Lifeline facility and segment tables are not ranked, since their
+# rows are not keyed by tract.
+RANKED_TRACT_FIELDS = {"eqTract": ["TotalEconLoss", "DebrisTotal", "SUM_2_3", "DisplacedHouseholds",
+                                   "ShortTermShelter", "PDsCompleteBC"],
+                       "eqPotableWaterDL": ["EconLoss"]}
+
+# PDsExceedModerate thresholds used to count damaged facilities
+EXCEED_MODERATE_THRESHOLDS = [0.25, 0.5, 0.75]
+
+
+class SummaryReport(object):
+    """Collects streaming aggregates for a single run of the map generator.
+
+    Rows are added one at a time with add_row() or add_facility() as they are
+    written to the geodatabase.  Only running totals, a bounded heap of the
+    top N rows for each ranked field and facility threshold counts are kept
+    in memory.  Aggregates are kept separately for each map so that a map can
+    be regenerated without counting its rows twice."""
+
+    def __init__(self, top_n=10, thresholds=None):
+        self.top_n = top_n
+        self.thresholds = thresholds or EXCEED_MODERATE_THRESHOLDS
+        self.current_map = None
+        # {(map, table, field): {"count": n, "total": x, "min": x, "max": x}}
+        self.totals = {}
+        # {(map, table, field): [(value, key), ...]} kept as a min-heap of size top_n
+        self.top_rows = {}
+        # {(map, table): {"count": n, threshold: n, ...}}
+        self.facilities = {}
+
+    def begin_map(self, map_name):
+        """Start collecting rows for map_name, discarding anything collected
+        the last time that map was created."""
+        for aggregates in (self.totals, self.top_rows, self.facilities):
+            for key in list(aggregates):
+                if key[0] == map_name:
+                    del aggregates[key]
+        self.current_map = map_name
+
+    def add_row(self, table, key, values):
+        """Fold a single result row into the regional totals.  The table
+        parameter is the feature class the row was written to, key is the join
+        key (e.g., the Tract) and values is a dictionary of field names and
+        the values written to them.  NULL values are skipped."""
+        ranked_fields = RANKED_TRACT_FIELDS.get(table, [])
+        for field, value in values.items():
+            if value is None:
+                continue
+            stats = self.totals.get((self.current_map, table, field))
+            if stats is None:
+                stats = {"count": 0, "total": 0.0, "min": value, "max": value}
+                self.totals[(self.current_map, table, field)] = stats
+            stats["count"] += 1
+            stats["total"] += value
+            stats["min"] = min(stats["min"], value)
+            stats["max"] = max(stats["max"], value)
+
+            if field in ranked_fields:
+                heap = self.top_rows.setdefault((self.current_map, table, field), [])
+                if len(heap) < self.top_n:
+                    heapq.heappush(heap, (value, key))
+                elif value > heap[0][0]:
+                    heapq.heapreplace(heap, (value, key))
+
+    def add_facility(self, table, key, pds_exceed_moderate, econ_loss=None):
+        """Count a lifeline facility or segment and whether its probability of
+        exceeding moderate damage is over each threshold."""
+        self.add_row(table, key, {"PDsExceedModerate": pds_exceed_moderate, "EconLoss": econ_loss})
+        counts = self.facilities.get((self.current_map, table))
+        if counts is None:
+            counts = dict((threshold, 0) for threshold in self.thresholds)
+            counts["count"] = 0
+            self.facilities[(self.current_map, table)] = counts
+        counts["count"] += 1
+        if pds_exceed_moderate is None:
+            return
+        for threshold in self.thresholds:
+            if pds_exceed_moderate > threshold:
+                counts[threshold] += 1
+
+    def regional_totals(self):
+        """Return the regional totals as a sorted list of dictionaries."""
+        rows = []
+        for (map_name, table, field), stats in sorted(self.totals.items()):
+            rows.append({"Map": map_name, "Table": table, "Field": field, "Count": stats["count"],
+                         "Total": stats["total"], "Min": stats["min"], "Max": stats["max"]})
+        return rows
+
+    def top_tracts(self):
+        """Return the top N rows for each ranked field, largest first."""
+        rows = []
+        for (map_name, table, field), heap in sorted(self.top_rows.items()):
+            for rank, (value, key) in enumerate(sorted(heap, reverse=True)):
+                rows.append({"Map": map_name, "Table": table, "Field": field, "Rank": rank + 1,
+                             "Key": key, "Value": value})
+        return rows
+
+    def facility_counts(self):
+        """Return the facility threshold counts as a sorted list of dictionaries."""
+        rows = []
+        for (map_name, table), counts in sorted(self.facilities.items()):
+            row = {"Map": map_name, "Table": table, "Count": counts["count"]}
+            for threshold in self.thresholds:
+                row["PDsExceedModerate>" + str(threshold)] = counts[threshold]
+            rows.append(row)
+        return rows
+
+    def write(self, out_dir):
+        """Write the summary tables as CSV files and a single JSON file into
+        out_dir.  Returns the list of files that were written."""
+        threshold_fields = ["PDsExceedModerate>" + str(t) for t in self.thresholds]
+        reports = [("RegionalTotals", ["Map", "Table", "Field", "Count", "Total", "Min", "Max"],
+                    self.regional_totals()),
+                   ("TopTracts", ["Map", "Table", "Field", "Rank", "Key", "Value"], self.top_tracts()),
+                   ("FacilityDamage", ["Map", "Table", "Count"] + threshold_fields, self.facility_counts())]
+
+        written = []
+        summary = {}
+        for name, fields, rows in reports:
+            out_csv = os.path.join(out_dir, name + ".csv")
+            with open(out_csv, "wb") as f:
+                writer = csv.DictWriter(f, fields)
+                writer.writerow(dict(zip(fields, fields)))
+                writer.writerows(rows)
+            written.append(out_csv)
+            summary[name] = rows
+
+        out_json = os.path.join(out_dir, "Summary.json")
+        with open(out_json, "w") as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+        written.append(out_json)
+        return written
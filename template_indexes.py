@@ -0,0 +1,71 @@
+# This module makes sure the template geodatabase has attribute indexes on the
+# fields the map functions filter on: the join keys used to match HAZUS results
+# to features, and the result fields update_fc uses to remove features outside
+# of the study region.  Without them every lookup is a full table scan, which
+# gets slow with larger (e.g., national) templates.
+
+import csv
+import os
+from arcpy import management
+from arcpy import ListIndexes
+from arcpy import Exists
+
+# {feature class: [join key, prune fields...]}
+TEMPLATE_INDEXES = {
+    "eqTract": ["Tract", "PDsSlightBC", "TotalEconLoss", "DebrisTotal", "Level1Injury", "PDsCompleteBC",
+                "DisplacedHouseholds"],
+    "eqHighwaySegment": ["HighwaySegID", "PDsExceedModerate"],
+    "eqHighwayBridge": ["HighwayBridgeId", "PDsExceedModerate"],
+    "eqCareFlty": ["CareFltyId", "PDsExceedModerate"],
+    "eqElectricPowerFlty": ["ElectricPowerFltyID", "PDsExceedModerate"],
+    "eqNaturalGasFlty": ["NaturalGasFltyID", "PDsExceedModerate"],
+    "eqOilFlty": ["OilFltyID", "PDsExceedModerate"],
+    "eqPotableWaterDL": ["Tract", "EconLoss"],
+}
+
+
+def indexed_fields(fc):
+    """Return the lower case names of the fields that lead an attribute index
+    on fc."""
+    fields = set()
+    for index in ListIndexes(fc):
+        if index.fields:
+            fields.add(index.fields[0].name.lower())
+    return fields
+
+
+def ensure_indexes(workspace, logger):
+    """Check every field in TEMPLATE_INDEXES for an attribute index and create
+    the ones that are missing.  Returns a list of (feature class, field, status)
+    tuples where status is "present", "created", "failed" or "missing fc"."""
+    results = []
+    for fc_name in sorted(TEMPLATE_INDEXES):
+        fc = workspace + "\\" + fc_name
+        if not Exists(fc):
+            for field in TEMPLATE_INDEXES[fc_name]:
+                results.append((fc_name, field, "missing fc"))
+            continue
+        existing = indexed_fields(fc)
+        for field in TEMPLATE_INDEXES[fc_name]:
+            if field.lower() in existing:
+                status = "present"
+            else:
+                try:
+                    management.AddIndex(fc, field, "IX_" + field, "NON_UNIQUE", "NON_ASCENDING")
+                    status = "created"
+                except Exception as e:
+                    logger.warning("Could not index " + fc_name + "." + field + ": " + str(e))
+                    status = "failed"
+            logger.info("Attribute index on " + fc_name + "." + field + ": " + status)
+            results.append((fc_name, field, status))
+    return results
+
+
+def write_index_report(results, out_dir):
+    """Write the results of ensure_indexes to TemplateIndexes.csv in out_dir."""
+    out_csv = os.path.join(out_dir, "TemplateIndexes.csv")
+    with open(out_csv, "wb") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Table", "Field", "Status"])
+        writer.writerows(results)
+    return out_csv
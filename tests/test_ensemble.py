@@ -0,0 +1,122 @@
+import logging
+import unittest
+
+try:
+    import ensemble
+except ImportError:
+    ensemble = None
+
+import lifeline_results
+
+
+class FakeCursor(object):
+    """Returns the same rows for every query, like a pyodbc cursor over one
+    scenario database."""
+
+    def __init__(self, columns, rows):
+        self.columns = columns
+        self.rows = rows
+        self.description = None
+        self.pending = []
+        self.closed = False
+
+    def execute(self, sql):
+        self.description = [(column, None, None, None, None, None, None) for column in self.columns]
+        self.pending = list(self.rows)
+        return self
+
+    def fetchmany(self, size=1):
+        batch, self.pending = self.pending[:size], self.pending[size:]
+        return batch
+
+    def close(self):
+        self.closed = True
+
+
+@unittest.skipIf(ensemble is None, "ensemble maps need numpy")
+class EnsembleCursorTest(unittest.TestCase):
+
+    columns = ["Tract", "TotalLoss"]
+    scenarios = [
+        [("1", 1.0), ("2", None), ("4", None)],
+        [("1", 3.0)],
+        [("1", 5.0), ("2", 4.0), ("3", 2.0)],
+    ]
+
+    def ensemble_rows(self, statistic, columns=None, scenarios=None, batch_size=5000):
+        cursors = [FakeCursor(columns or self.columns, rows) for rows in (scenarios or self.scenarios)]
+        cursor = ensemble.EnsembleCursor(cursors, statistic, logging.getLogger("test"), batch_size)
+        return dict((row[0], row) for row in cursor.execute("SELECT ...").fetchall())
+
+    def assert_values(self, statistic, expected):
+        rows = self.ensemble_rows(statistic)
+        self.assertEqual(sorted(rows), ["1", "2", "3", "4"])
+        for key, value in expected.items():
+            if value is None:
+                self.assertIsNone(rows[key].TotalLoss)
+            else:
+                self.assertAlmostEqual(rows[key].TotalLoss, value)
+
+    def test_statistics_ignore_nulls_and_missing_scenarios(self):
+        # Tract 2 is NULL in one scenario and missing from another, tract 3 is
+        # only in one scenario and tract 4 only has a NULL value
+        self.assert_values("mean", {"1": 3.0, "2": 4.0, "3": 2.0, "4": None})
+        self.assert_values("min", {"1": 1.0, "2": 4.0, "3": 2.0, "4": None})
+        self.assert_values("max", {"1": 5.0, "2": 4.0, "3": 2.0, "4": None})
+        self.assert_values("p50", {"1": 3.0, "2": 4.0, "3": 2.0, "4": None})
+        # Linear interpolation between the 2nd and 3rd of 1, 3, 5
+        self.assert_values("p90", {"1": 4.6, "2": 4.0, "3": 2.0, "4": None})
+        self.assert_values("p10", {"1": 1.4, "2": 4.0, "3": 2.0, "4": None})
+
+    def test_unknown_statistic(self):
+        self.assertRaises(ValueError, ensemble.EnsembleCursor, [], "median", logging.getLogger("test"))
+
+    def test_derived_columns_get_their_own_statistic(self):
+        columns = ["Tract", "Level2Injury", "Level3Injury", "SUM_2_3"]
+        scenarios = [[("1", 10.0, 0.0, 10.0)], [("1", 0.0, 10.0, 10.0)], [("1", 5.0, 5.0, 10.0)]]
+        row = self.ensemble_rows("p90", columns, scenarios)["1"]
+        self.assertAlmostEqual(row.SUM_2_3, 10.0)
+        # Adding the statistics of the parts would give 18
+        self.assertAlmostEqual(row.Level2Injury + row.Level3Injury, 18.0)
+
+        columns = ["Tract", "PDsSlightBC", "PDsModerateBC", "SL_MO_TOT"]
+        scenarios = [[("1", 1.0, 9.0, 10.0)], [("1", 9.0, 1.0, 10.0)]]
+        row = self.ensemble_rows("max", columns, scenarios)["1"]
+        self.assertAlmostEqual(row.SL_MO_TOT, 10.0)
+
+    def test_rows_read_like_pyodbc_rows(self):
+        cursors = [FakeCursor(self.columns, rows) for rows in self.scenarios]
+        cursor = ensemble.EnsembleCursor(cursors, "mean", logging.getLogger("test"), batch_size=1)
+        cursor.execute("SELECT ...")
+        first = cursor.fetchmany(2)
+        rest = cursor.fetchall()
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(rest), 2)
+        self.assertEqual(cursor.fetchmany(5), [])
+        row = first[0]
+        self.assertEqual(row.Tract, row[0])
+        self.assertEqual(row.TotalLoss, row[1])
+        self.assertIsInstance(row.TotalLoss, float)
+        cursor.close()
+        self.assertTrue(all(c.closed for c in cursors))
+
+    def test_lifeline_results_from_ensemble_cursor(self):
+        columns = ["CareFltyID", "PDsExceedModerate", "FunctDay1", "EconLoss"]
+        scenarios = [[("CA01", 0.2, 80.0, 100.0), ("CA02", None, 50.0, 10.0)],
+                     [("CA01", 0.4, 60.0, 300.0)]]
+        cursors = [FakeCursor(columns, rows) for rows in scenarios]
+        cursor = ensemble.EnsembleCursor(cursors, "mean", logging.getLogger("test"))
+        cursor.execute("SELECT ...")
+        results = lifeline_results.LifelineResults.from_cursor(cursor, "eqCareFlty", batch_size=1)
+        rows = sorted(results)
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0][0], "CA01")
+        self.assertAlmostEqual(rows[0][1], 0.3)
+        self.assertAlmostEqual(rows[0][2], 70.0)
+        self.assertAlmostEqual(rows[0][3], 200.0)
+        self.assertEqual(rows[1][0], "CA02")
+        self.assertIsNone(rows[1][1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import render_queue
+
+
+def dead_pid():
+    """Return the ID of a process that has already exited."""
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+class SpoolQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.queue = render_queue.SpoolQueue(self.spool_dir)
+        self.job = {"server": "HAZUS", "database": "Napa", "maps": ["Shelter Needs", "Utility Damage"],
+                    "profile": None, "ensemble": None, "statistic": None}
+
+    def tearDown(self):
+        shutil.rmtree(self.spool_dir)
+
+    def test_submit_deduplicates_pending_jobs(self):
+        jid = self.queue.submit(self.job)
+        reordered = dict(self.job, maps=["Utility Damage", "Shelter Needs"])
+        self.assertEqual(self.queue.submit(reordered), jid)
+        self.assertEqual(len(self.queue.jobs()), 1)
+        self.assertEqual(self.queue.status(jid)["state"], "pending")
+
+    def test_submit_rejects_unknown_names(self):
+        for bad in [dict(self.job, maps=["Shelter Need"]),
+                    dict(self.job, profile=["fields"]),
+                    dict(self.job, ensemble=["Napa2"], statistic="median"),
+                    dict(self.job, statistic="mean")]:
+            self.assertRaises(ValueError, self.queue.submit, bad)
+        self.assertEqual(self.queue.jobs(), [])
+
+    def test_claim_and_finish(self):
+        jid = self.queue.submit(self.job)
+        job = self.queue.claim()
+        self.assertEqual(job["id"], jid)
+        self.assertEqual(job["pid"], os.getpid())
+        self.assertEqual(self.queue.status(jid)["state"], "running")
+        self.assertIsNone(self.queue.claim())
+        # A running job is not submitted twice
+        self.assertEqual(self.queue.submit(self.job), jid)
+        self.assertIsNone(self.queue.claim())
+
+        self.queue.finish(job, True, returncode=0)
+        self.assertEqual(self.queue.status(jid)["state"], "done")
+        # Submitting a finished job queues it again
+        self.queue.submit(self.job)
+        self.assertEqual(self.queue.status(jid)["state"], "pending")
+
+    def test_recover_requeues_jobs_of_dead_services(self):
+        jid = self.queue.submit(self.job)
+        job = self.queue.claim()
+        self.assertEqual(self.queue.recover(), [])
+
+        job["pid"] = dead_pid()
+        self.queue.write("running", job)
+        self.assertEqual(self.queue.recover(), [jid])
+        record = self.queue.status(jid)
+        self.assertEqual(record["state"], "pending")
+        self.assertEqual(record["requeued"], 1)
+        self.assertEqual(self.queue.claim()["id"], jid)
+
+    def test_submit_requeues_a_stale_running_job(self):
+        jid = self.queue.submit(self.job)
+        job = self.queue.claim()
+        job["pid"] = dead_pid()
+        self.queue.write("running", job)
+        self.assertEqual(self.queue.submit(self.job), jid)
+        self.assertEqual(self.queue.status(jid)["state"], "pending")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import shutil
+import tempfile
+import unittest
+
+try:
+    import geopandas
+    from shapely.geometry import box
+    import tile_export
+except ImportError:
+    geopandas = None
+
+
+@unittest.skipIf(geopandas is None, "tile export needs geopandas, shapely and matplotlib")
+class TileExportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.source = self.temp_dir + "/StudyRegionData.gpkg"
+        self.out_dir = self.temp_dir + "/tiles"
+        # A 4 x 5 grid of tracts, each about a tile wide at zoom 12
+        tracts = []
+        for row in range(4):
+            for column in range(5):
+                x = -122.5 + column * 0.1
+                y = 38.0 + row * 0.1
+                tracts.append({"Tract": "06055%06d" % (row * 5 + column), "DebrisS": 200.0,
+                               "geometry": box(x, y, x + 0.1, y + 0.1)})
+        self.tracts = geopandas.GeoDataFrame(tracts, crs="EPSG:4269")
+        self.tracts.to_file(self.source, layer="eqTract", driver="GPKG")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def export(self):
+        return tile_export.export_tiles(self.source, ["estimated_debris"], self.out_dir, zooms=[12],
+                                        processes=2)["estimated_debris"]
+
+    def test_only_tiles_of_a_changed_tract_are_rendered(self):
+        first = self.export()
+        total = first["rendered"] + first["empty"]
+        self.assertGreater(first["rendered"], 0)
+
+        again = self.export()
+        self.assertEqual(again["rendered"], 0)
+        self.assertEqual(again["skipped"], first["rendered"])
+
+        self.tracts.loc[0, "DebrisS"] = 2000.0
+        self.tracts.to_file(self.source, layer="eqTract", driver="GPKG")
+        changed = self.export()
+        # Only the tiles around the first tract (with room for the tile padding) can change
+        near = tile_export.tiles_for_extent(self.tracts.geometry[0].buffer(0.01).bounds, "EPSG:4269", [12])
+        self.assertGreater(changed["rendered"], 0)
+        self.assertLessEqual(changed["rendered"], len(near))
+        self.assertEqual(changed["rendered"] + changed["skipped"] + changed["empty"], total)
+        self.assertGreaterEqual(changed["skipped"], first["rendered"] - len(near))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import sys
+import types
+import unittest
+
+try:
+    import arcpy
+except ImportError:
+    # writeback only needs arcpy.da.UpdateCursor, which the tests replace
+    arcpy = types.ModuleType("arcpy")
+    arcpy.da = types.ModuleType("arcpy.da")
+    sys.modules["arcpy"] = arcpy
+    sys.modules["arcpy.da"] = arcpy.da
+
+import writeback
+
+
+class FakeFeatureClass(object):
+    """A feature class of [key, value] rows.  order sorts the keys the way the
+    geodatabase would for ORDER BY."""
+
+    def __init__(self, keys, order=None):
+        self.features = [[key, None] for key in keys]
+        self.order = order
+        self.sql_clauses = []
+
+    def value(self, key):
+        return [feature[1] for feature in self.features if feature[0] == key][0]
+
+
+class FakeUpdateCursor(object):
+
+    def __init__(self, fc, fields, sql_clause=None):
+        self.fc = fc
+        self.fields = fields
+        fc.sql_clauses.append(sql_clause)
+        self.features = sorted(fc.features, key=lambda feature: fc.order(feature[0]))
+        self.current = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def __iter__(self):
+        for feature in self.features:
+            self.current = feature
+            yield list(feature)
+
+    def updateRow(self, row):
+        self.current[:] = row
+
+
+class FakeDa(object):
+    UpdateCursor = FakeUpdateCursor
+
+
+class OrderedUpdateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.da = writeback.da
+        writeback.da = FakeDa
+
+    def tearDown(self):
+        writeback.da = self.da
+
+    def update(self, fc, rows):
+        return writeback.ordered_update(fc, "Tract", ["Value"], rows, lambda row: [row[1]])
+
+    def test_sorted_inputs(self):
+        fc = FakeFeatureClass(["003", "001", "002", "004"], order=lambda key: key)
+        rows = [("001", 1.0), ("002", 2.0), ("004", 4.0)]
+        self.assertEqual(self.update(fc, rows), 3)
+        self.assertEqual(fc.sql_clauses, [(None, "ORDER BY Tract")])
+        self.assertEqual([fc.value(k) for k in ["001", "002", "003", "004"]], [1.0, 2.0, None, 4.0])
+
+    def test_feature_class_out_of_python_order(self):
+        # The geodatabase sorts numbers numerically, so 9 comes before 10 and
+        # the merge has to fall back to a lookup part way through the pass
+        fc = FakeFeatureClass(["10", "9", "11", "8"], order=int)
+        rows = [("10", 10.0), ("11", 11.0), ("8", 8.0), ("9", 9.0)]
+        self.assertEqual(self.update(fc, rows), 4)
+        self.assertEqual([fc.value(k) for k in ["8", "9", "10", "11"]], [8.0, 9.0, 10.0, 11.0])
+
+    def test_results_out_of_python_order(self):
+        fc = FakeFeatureClass(["A", "B", "C"], order=lambda key: key)
+        rows = [("C", 3.0), ("A", 1.0), ("B", 2.0)]
+        self.assertEqual(self.update(fc, rows), 3)
+        self.assertEqual([fc.value(k) for k in ["A", "B", "C"]], [1.0, 2.0, 3.0])
+
+    def test_keys_differing_in_case_and_trailing_spaces(self):
+        fc = FakeFeatureClass(["ca0001 ", "CA0002", "ca0003"], order=lambda key: key.upper())
+        rows = [("CA0001", 1.0), ("ca0002", 2.0), ("CA0003  ", 3.0)]
+        self.assertEqual(self.update(fc, rows), 3)
+        self.assertEqual([fc.value(k) for k in ["ca0001 ", "CA0002", "ca0003"]], [1.0, 2.0, 3.0])
+        # The feature keeps its own key
+        self.assertEqual(sorted(feature[0] for feature in fc.features), ["CA0002", "ca0001 ", "ca0003"])
+
+    def test_unmatched_features_stay_null(self):
+        fc = FakeFeatureClass(["001", "002", "003", "005"], order=lambda key: key)
+        rows = [("002", 2.0), ("004", 4.0), ("006", 6.0)]
+        self.assertEqual(self.update(fc, rows), 1)
+        self.assertEqual([fc.value(k) for k in ["001", "002", "003", "005"]], [None, 2.0, None, None])
+
+    def test_no_results(self):
+        fc = FakeFeatureClass(["001"], order=lambda key: key)
+        self.assertEqual(self.update(fc, []), 0)
+        self.assertIsNone(fc.value("001"))
+
+    def test_normalize_key(self):
+        self.assertEqual(writeback.normalize_key(" ab1 "), "AB1")
+        self.assertEqual(writeback.normalize_key(12), 12)
+        self.assertTrue(writeback.is_ordered([("a",), ("B",), ("c",)]))
+        self.assertFalse(writeback.is_ordered([("b",), ("A",)]))
+
+
+if __name__ == "__main__":
+    unittest.main()
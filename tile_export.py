@@ -0,0 +1,251 @@
+# This module exports the HAZUS Map Generator layers as a static XYZ tile
+# pyramid (256 x 256 PNG tiles in Web Mercator) so a dashboard can serve them as
+# plain files.  Tiles are drawn with the same symbology as headless_render.py,
+# rendered in parallel, and only re-rendered when the features that fall in a
+# tile have changed since the last export.
+#
+# Tiles are written to <output dir>/<map name>/<z>/<x>/<y>.png, next to a
+# manifest.json that records a hash of the content of each tile.
+#
+# Usage:
+#   python tile_export.py <data source> <output dir> [<map> ...] [--zoom <min> <max>]
+#                         [--extent <xmin> <ymin> <xmax> <ymax> | --extent-file <MapExtent.json>]
+#                         [--extent-crs <crs>] [--processes <n>]
+#
+# Dependencies: geopandas, shapely, numpy and matplotlib
+
+import argparse
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import geopandas
+
+import headless_render
+
+TILE_SIZE = 256
+WEB_MERCATOR = "EPSG:3857"
+# Half the width of the Web Mercator world in meters
+ORIGIN_SHIFT = 20037508.342789244
+# The template geodatabase uses GCS North American 1983
+DEFAULT_EXTENT_CRS = "EPSG:4269"
+DEFAULT_ZOOM = (6, 12)
+
+
+def lonlat_to_tile(lon, lat, zoom):
+    """Return the x, y index of the tile containing a longitude and latitude."""
+    lat = max(min(lat, 85.0511), -85.0511)
+    n = 2 ** zoom
+    x = int((lon + 180.0) / 360.0 * n)
+    lat_radians = math.radians(lat)
+    y = int((1.0 - math.log(math.tan(lat_radians) + 1.0 / math.cos(lat_radians)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_bounds(z, x, y):
+    """Return the (xmin, ymin, xmax, ymax) Web Mercator bounds of a tile."""
+    size = 2 * ORIGIN_SHIFT / (2 ** z)
+    xmin = -ORIGIN_SHIFT + x * size
+    ymax = ORIGIN_SHIFT - y * size
+    return xmin, ymax - size, xmin + size, ymax
+
+
+def tiles_for_extent(extent, extent_crs, zooms):
+    """Return a list of (z, x, y) tiles covering an extent at each zoom level."""
+    corners = geopandas.GeoSeries.from_xy([extent[0], extent[2]], [extent[1], extent[3]], crs=extent_crs)
+    corners = corners.to_crs("EPSG:4326")
+    west, east = corners.x.min(), corners.x.max()
+    south, north = corners.y.min(), corners.y.max()
+    tiles = []
+    for z in zooms:
+        xmin, ymin = lonlat_to_tile(west, north, z)
+        xmax, ymax = lonlat_to_tile(east, south, z)
+        for x in range(xmin, xmax + 1):
+            for y in range(ymin, ymax + 1):
+                tiles.append((z, x, y))
+    return tiles
+
+
+def prepare_layers(source, map_function):
+    """Read and style the layers of a map product once, in Web Mercator.  Dot
+    density layers are turned into points here so the same dots are drawn in
+    every tile.  Returns a list of (kind, GeoDataFrame) pairs where each frame
+    has a color column."""
+    map_name, title, layers = headless_render.MAP_PRODUCTS[map_function]
+    frames = []
+    read = {}
+    for layer in layers:
+        style = headless_render.LAYER_STYLES[layer]
+        if style["fc"] not in read:
+            read[style["fc"]] = headless_render.read_layer(source, style["fc"])
+        gdf = read[style["fc"]]
+        if style["renderer"] == "dots":
+            xs, ys = headless_render.dot_density_points(gdf, style["field"], style["dot_value"])
+            points = geopandas.GeoDataFrame(geometry=geopandas.points_from_xy(xs, ys), crs=gdf.crs)
+            points["color"] = style["color"]
+            frames.append(("dots", points.to_crs(WEB_MERCATOR)))
+        else:
+            classes = headless_render.classify(gdf[style["field"]], style["breaks"])
+            styled = gdf[classes >= 0].copy()
+            styled["color"] = [style["colors"][c] for c in classes[classes >= 0]]
+            frames.append(("classes", styled[["geometry", "color"]].to_crs(WEB_MERCATOR)))
+    return frames
+
+
+def tile_content(frames, bounds):
+    """Return the parts of each frame that intersect the tile bounds and a hash
+    of that content.  The hash is None if the tile is empty."""
+    parts = []
+    digest = hashlib.sha1()
+    # Include features just outside the tile so symbols on the edge are not cut off
+    pad = (bounds[2] - bounds[0]) * 0.02
+    for kind, gdf in frames:
+        part = gdf.cx[bounds[0] - pad:bounds[2] + pad, bounds[1] - pad:bounds[3] + pad]
+        parts.append((kind, part))
+        for geometry, color in zip(part.geometry, part["color"]):
+            digest.update(geometry.wkb)
+            digest.update(color.encode("ascii"))
+    if all(len(part) == 0 for kind, part in parts):
+        return parts, None
+    return parts, digest.hexdigest()
+
+
+def draw_tile(parts, bounds, out_file):
+    """Draw the content of a tile as a transparent 256 x 256 PNG."""
+    fig = plt.figure(figsize=(1, 1), dpi=TILE_SIZE)
+    ax = fig.add_axes([0, 0, 1, 1])
+    for kind, part in parts:
+        if not len(part):
+            continue
+        geom_type = part.geom_type.iloc[0]
+        if kind == "dots":
+            ax.scatter(part.geometry.x, part.geometry.y, s=0.4, c=list(part["color"]), linewidths=0)
+        elif geom_type in ("Point", "MultiPoint"):
+            part.plot(ax=ax, color=part["color"], markersize=4, edgecolor="#404040", linewidth=0.2)
+        elif geom_type in ("LineString", "MultiLineString"):
+            part.plot(ax=ax, color=part["color"], linewidth=0.6)
+        else:
+            part.plot(ax=ax, color=part["color"], edgecolor="#808080", linewidth=0.1)
+    ax.set_xlim(bounds[0], bounds[2])
+    ax.set_ylim(bounds[1], bounds[3])
+    ax.set_axis_off()
+    folder = os.path.dirname(out_file)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    fig.savefig(out_file, dpi=TILE_SIZE, transparent=True)
+    plt.close(fig)
+
+
+# Each worker process prepares the layers of a map once and keeps them here
+_worker_frames = {}
+
+
+def _init_worker(frames):
+    _worker_frames.update(frames)
+
+
+def _render_tile(task):
+    """Render one tile if its content changed.  Returns the tile, its new
+    hash and what was done: "rendered", "skipped" or "empty"."""
+    map_function, (z, x, y), old_hash, out_file = task
+    bounds = tile_bounds(z, x, y)
+    parts, new_hash = tile_content(_worker_frames[map_function], bounds)
+    if new_hash is None:
+        if os.path.exists(out_file):
+            os.remove(out_file)
+        return map_function, (z, x, y), None, "empty"
+    if new_hash == old_hash and os.path.exists(out_file):
+        return map_function, (z, x, y), new_hash, "skipped"
+    draw_tile(parts, bounds, out_file)
+    return map_function, (z, x, y), new_hash, "rendered"
+
+
+def export_tiles(source, map_functions, out_dir, extent=None, extent_crs=DEFAULT_EXTENT_CRS, zooms=None,
+                 processes=None):
+    """Export a tile pyramid for each map product over extent (xmin, ymin, xmax,
+    ymax in extent_crs; by default the extent of the study region tracts).
+    Returns a dictionary of {map function: {"rendered": n, "skipped": n, "empty": n}}."""
+    if zooms is None:
+        zooms = range(DEFAULT_ZOOM[0], DEFAULT_ZOOM[1] + 1)
+    if extent is None:
+        tracts = headless_render.read_layer(source, "eqTract")
+        extent = tuple(tracts.total_bounds)
+        extent_crs = tracts.crs
+    tiles = tiles_for_extent(extent, extent_crs, zooms)
+
+    frames = {}
+    manifests = {}
+    tasks = []
+    for map_function in map_functions:
+        frames[map_function] = prepare_layers(source, map_function)
+        map_dir = os.path.join(out_dir, headless_render.MAP_PRODUCTS[map_function][0])
+        manifest_path = os.path.join(map_dir, "manifest.json")
+        manifest = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        manifests[map_function] = manifest
+        for z, x, y in tiles:
+            key = "%d/%d/%d" % (z, x, y)
+            out_file = os.path.join(map_dir, str(z), str(x), str(y) + ".png")
+            tasks.append((map_function, (z, x, y), manifest.get(key), out_file))
+
+    pool = multiprocessing.Pool(processes, _init_worker, (frames,))
+    try:
+        results = pool.map(_render_tile, tasks, chunksize=16)
+    finally:
+        pool.close()
+        pool.join()
+
+    counts = dict((m, {"rendered": 0, "skipped": 0, "empty": 0}) for m in map_functions)
+    for map_function, (z, x, y), tile_hash, action in results:
+        counts[map_function][action] += 1
+        key = "%d/%d/%d" % (z, x, y)
+        if tile_hash is None:
+            manifests[map_function].pop(key, None)
+        else:
+            manifests[map_function][key] = tile_hash
+
+    for map_function in map_functions:
+        map_dir = os.path.join(out_dir, headless_render.MAP_PRODUCTS[map_function][0])
+        if not os.path.isdir(map_dir):
+            os.makedirs(map_dir)
+        with open(os.path.join(map_dir, "manifest.json"), "w") as f:
+            json.dump(manifests[map_function], f, indent=0, sort_keys=True)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export HAZUS Map Generator layers as an XYZ tile pyramid")
+    parser.add_argument("source", help="populated StudyRegionData geodatabase or a copy GDAL can read")
+    parser.add_argument("out_dir")
+    parser.add_argument("maps", nargs="*", help="map functions to export, e.g. shelter_needs (default: all)")
+    parser.add_argument("--zoom", type=int, nargs=2, default=list(DEFAULT_ZOOM), metavar=("MIN", "MAX"))
+    parser.add_argument("--extent", type=float, nargs=4, default=None, metavar=("XMIN", "YMIN", "XMAX", "YMAX"),
+                        help="extent to tile (default: the extent of the study region tracts)")
+    parser.add_argument("--extent-file", default=None,
+                        help="read the extent from the Summary_Reports/MapExtent.json written by the map generator")
+    parser.add_argument("--extent-crs", default=DEFAULT_EXTENT_CRS)
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    maps = args.maps or sorted(headless_render.MAP_PRODUCTS)
+    zooms = range(args.zoom[0], args.zoom[1] + 1)
+    if args.extent_file:
+        with open(args.extent_file) as f:
+            map_extent = json.load(f)
+        args.extent = [map_extent["XMin"], map_extent["YMin"], map_extent["XMax"], map_extent["YMax"]]
+    counts = export_tiles(args.source, maps, args.out_dir, args.extent, args.extent_crs, zooms, args.processes)
+    for map_function in maps:
+        print("%s: %d rendered, %d unchanged, %d empty" % (
+            map_function, counts[map_function]["rendered"], counts[map_function]["skipped"],
+            counts[map_function]["empty"]))
+
+
+if __name__ == "__main__":
+    main()
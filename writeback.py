@@ -0,0 +1,110 @@
+# This module schedules the write-back of HAZUS results into the template
+# geodatabase.  Each task writes one result set into one feature class, and the
+# time spent on each feature class is logged.
+#
+# The tasks run one after another.  The template is a personal geodatabase
+# (.mdb), which only allows a single writer, and arcpy cursors must not be used
+# from several threads of one process.
+
+import os
+import time
+
+from arcpy import da
+
+
+def normalize_key(key):
+    """Return a join key without surrounding spaces and folded to upper case.
+    Keys used to be matched with [Key] = 'x' queries, which the personal
+    geodatabase compares without regard to case or trailing spaces."""
+    if hasattr(key, "upper"):
+        return key.strip().upper()
+    return key
+
+
+def is_ordered(rows):
+    """Return True if the normalized keys (the first column) of rows never
+    decrease."""
+    previous = None
+    for row in rows:
+        key = normalize_key(row[0])
+        if previous is not None and key < previous:
+            return False
+        previous = key
+    return True
+
+
+def key_lookup(rows):
+    return dict((normalize_key(row[0]), row) for row in rows)
+
+
+def ordered_update(fc, key_field, fields, rows, row_values):
+    """Write result rows to the feature class fc in a single UpdateCursor pass.
+
+    rows is a list (or any container that can be iterated more than once) of
+    rows with the key first, as returned in key order by the extraction
+    queries.  The features are read in key order too, so the two sequences are
+    merged without looking anything up.  Keys are compared after
+    normalize_key, on both sides.  row_values(row) returns the values to write
+    to fields for a matching feature.  If either side turns out not to
+    be in the same order (e.g., the server and the geodatabase collate keys
+    differently), the rest of the features are matched through a dictionary
+    instead.  Returns the number of features updated."""
+    lookup = None
+    if not is_ordered(rows):
+        lookup = key_lookup(rows)
+    results = iter(rows)
+    current = next(results, None)
+    current_key = None if current is None else normalize_key(current[0])
+    previous = None
+    updated = 0
+    sql_clause = (None, "ORDER BY " + key_field)
+    with da.UpdateCursor(fc, [key_field] + fields, sql_clause=sql_clause) as urows:
+        for urow in urows:
+            key = normalize_key(urow[0])
+            if lookup is None and previous is not None and key < previous:
+                lookup = key_lookup(rows)
+            previous = key
+            if lookup is not None:
+                row = lookup.get(key)
+            else:
+                while current is not None and current_key < key:
+                    current = next(results, None)
+                    current_key = None if current is None else normalize_key(current[0])
+                row = current if current is not None and current_key == key else None
+            if row is not None:
+                urows.updateRow([urow[0]] + list(row_values(row)))
+                updated += 1
+    return updated
+
+
+class WriteBackScheduler(object):
+    """Runs write-back tasks grouped by feature class.  Tasks for the same
+    feature class run one after another in the order they were added."""
+
+    def __init__(self, logger):
+        self.logger = logger
+        # [(feature class, [(description, function, args), ...]), ...]
+        self.groups = []
+
+    def add(self, fc, description, function, *args):
+        """Add a task that calls function(*args) to write to the feature class fc."""
+        for group_fc, tasks in self.groups:
+            if group_fc == fc:
+                tasks.append((description, function, args))
+                return
+        self.groups.append((fc, [(description, function, args)]))
+
+    def run_group(self, fc, tasks):
+        for description, function, args in tasks:
+            start = time.time()
+            function(*args)
+            self.logger.info("Wrote %s to %s in %.1f seconds" % (description, os.path.basename(fc),
+                                                                 time.time() - start))
+
+    def run(self):
+        """Run all of the tasks, one feature class at a time."""
+        start = time.time()
+        groups, self.groups = self.groups, []
+        for fc, tasks in groups:
+            self.run_group(fc, tasks)
+        self.logger.info("Finished write-back in %.1f seconds" % (time.time() - start))